@@ -7,6 +7,18 @@ from app_run.models import Run, CollectibleItem
 class RunAdmin(admin.ModelAdmin):
     list_display = ('athlete', 'created_at', 'comment')
     list_filter = ('created_at',)
+    list_select_related = ('athlete',)
+    readonly_fields = ('status', 'distance', 'run_time_seconds', 'speed', 'first_position_at', 'last_position_at',
+                       'positions_count', 'speed_sum', 'archived_at')
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).defer('track')
+
+    def get_readonly_fields(self, request, obj=None):
+        # the athlete stats follow the run's athlete, so a saved run keeps it
+        if obj is not None:
+            return self.readonly_fields + ('athlete',)
+        return self.readonly_fields
 
 
 @admin.register(CollectibleItem)
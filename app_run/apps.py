@@ -1,4 +1,5 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class AppRunConfig(AppConfig):
@@ -7,4 +8,12 @@ class AppRunConfig(AppConfig):
 
     def ready(self):
         import app_run.signals
+        if settings.STARTUP_WARMUP:
+            self.warm_up()
         super().ready()
+
+    def warm_up(self):
+        from django.urls import get_resolver
+
+        # imports every view and compiles the URL patterns at startup instead of on the first request
+        get_resolver().reverse_dict
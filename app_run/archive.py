@@ -0,0 +1,126 @@
+import struct
+import zlib
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+import numpy as np
+from django.db import transaction
+from django.utils import timezone
+
+from app_run.models import Position, Run
+
+TRACK_VERSION = 1
+HEADER = struct.Struct('<BI')
+COORDINATE_SCALE = 10 ** 4
+NULL_TIME = np.iinfo(np.int64).min
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+FIELDS = ['id', 'latitude', 'longitude', 'date_time', 'distance', 'speed', 'created_at']
+DELTA_COLUMNS = ['id', 'latitude', 'longitude', 'date_time', 'created_at']
+FLOAT_COLUMNS = ['distance', 'speed']
+
+
+def to_microseconds(value):
+    if value is None:
+        return NULL_TIME
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+
+def from_microseconds(value):
+    if value == NULL_TIME:
+        return None
+    return EPOCH + timedelta(microseconds=int(value))
+
+
+def pack_track(rows):
+    """Pack (id, latitude, longitude, date_time, distance, speed, created_at) rows into a zlib blob.
+
+    Integer columns are stored as int64 deltas and coordinates as fixed point with the
+    four decimal places of Position, so unpacking restores the rows exactly.
+    """
+    rows = list(rows)
+    columns = {
+        'id': [row[0] for row in rows],
+        'latitude': [int(row[1] * COORDINATE_SCALE) for row in rows],
+        'longitude': [int(row[2] * COORDINATE_SCALE) for row in rows],
+        'date_time': [to_microseconds(row[3]) for row in rows],
+        'distance': [row[4] for row in rows],
+        'speed': [row[5] for row in rows],
+        'created_at': [to_microseconds(row[6]) for row in rows],
+    }
+    chunks = []
+    for name in DELTA_COLUMNS:
+        values = np.array(columns[name], dtype='<i8')
+        with np.errstate(over='ignore'):
+            chunks.append(np.diff(values, prepend=np.int64(0)).astype('<i8').tobytes())
+    for name in FLOAT_COLUMNS:
+        chunks.append(np.array(columns[name], dtype='<f8').tobytes())
+    return HEADER.pack(TRACK_VERSION, len(rows)) + zlib.compress(b''.join(chunks), 9)
+
+
+def unpack_track(blob):
+    """Return the packed track as a dict of NumPy columns."""
+    version, count = HEADER.unpack_from(blob)
+    if version != TRACK_VERSION:
+        raise ValueError(f'Unsupported track version {version}')
+    data = zlib.decompress(bytes(blob)[HEADER.size:])
+    columns = {}
+    offset = 0
+    for name in DELTA_COLUMNS:
+        deltas = np.frombuffer(data, dtype='<i8', count=count, offset=offset)
+        with np.errstate(over='ignore'):
+            columns[name] = np.cumsum(deltas, dtype=np.int64)
+        offset += count * 8
+    for name in FLOAT_COLUMNS:
+        columns[name] = np.frombuffer(data, dtype='<f8', count=count, offset=offset)
+        offset += count * 8
+    columns['latitude'] = columns['latitude'] / COORDINATE_SCALE
+    columns['longitude'] = columns['longitude'] / COORDINATE_SCALE
+    return columns
+
+
+def iter_track_rows(blob):
+    columns = unpack_track(blob)
+    for index in range(len(columns['id'])):
+        yield (
+            int(columns['id'][index]),
+            Decimal(round(float(columns['latitude'][index]) * COORDINATE_SCALE)).scaleb(-4),
+            Decimal(round(float(columns['longitude'][index]) * COORDINATE_SCALE)).scaleb(-4),
+            from_microseconds(columns['date_time'][index]),
+            float(columns['distance'][index]),
+            float(columns['speed'][index]),
+            from_microseconds(columns['created_at'][index]),
+        )
+
+
+def build_positions(run_id, blob):
+    return [Position(run_id=run_id, **dict(zip(FIELDS, row))) for row in iter_track_rows(blob)]
+
+
+def archive_run(run):
+    with transaction.atomic():
+        run = Run.objects.select_for_update().get(pk=run.pk)
+        if run.status != Run.FINISHED or run.track is not None:
+            return False
+        rows = Position.objects.filter(run=run).order_by('created_at', 'id').values_list(*FIELDS)
+        run.track = pack_track(rows)
+        run.archived_at = timezone.now()
+        run.save(update_fields=['track', 'archived_at'])
+        Position.objects.filter(run=run).delete()
+    return True
+
+
+def restore_run(run):
+    with transaction.atomic():
+        run = Run.objects.select_for_update().get(pk=run.pk)
+        if run.track is None:
+            return False
+        positions = build_positions(run.id, run.track)
+        created_at = [position.created_at for position in positions]
+        Position.objects.bulk_create(positions, batch_size=1000)
+        for position, value in zip(positions, created_at):
+            position.created_at = value
+        Position.objects.bulk_update(positions, ['created_at'], batch_size=1000)
+        run.track = None
+        run.archived_at = None
+        run.save(update_fields=['track', 'archived_at'])
+    return True
@@ -0,0 +1,153 @@
+import asyncio
+
+import orjson
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.http import HttpResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from rest_framework import status
+from rest_framework.relations import PrimaryKeyRelatedField
+
+from app_run.challenges import evaluate_run
+from app_run.helpers import calculate_position_metrics
+from app_run.live import RUN, format_event, get_broker, publish_positions, publish_run, run_channel
+from app_run.models import Position, Run
+from app_run.renderers import ORJSONRenderer
+from app_run.serializers import PositionFixSerializer, PositionSerializer, RunSerializer
+from app_run.signals import collect_items_for_run
+from app_run.stats import update_run_totals
+
+NOT_FOUND = {'detail': 'No Run matches the given query.'}
+
+
+def render(data, status_code=status.HTTP_200_OK):
+    return HttpResponse(ORJSONRenderer().render(data), content_type='application/json', status=status_code)
+
+
+def parse_body(request):
+    if request.content_type == 'application/json':
+        try:
+            return orjson.loads(request.body or b'{}')
+        except ValueError:
+            return None
+    return request.POST
+
+
+async def get_run(run_id):
+    try:
+        return await Run.objects.select_related('athlete').defer('track').aget(pk=run_id)
+    except (Run.DoesNotExist, ValueError, TypeError):
+        return None
+
+
+def save_position(position, segment):
+    with transaction.atomic():
+        position.save()
+        update_run_totals(position.run_id, 1, segment, position.speed, position.date_time, position.date_time)
+        publish_positions(position.run_id, [position])
+
+
+def finish_run(run):
+    with transaction.atomic():
+        run.save(update_fields=['status', 'run_time_seconds', 'speed'])
+        evaluate_run(run)
+        if settings.COLLECT_ITEMS_ON_STOP:
+            collect_items_for_run(run)
+        publish_run(run)
+
+
+@csrf_exempt
+@require_POST
+async def create_position(request):
+    """Async counterpart of PositionViewSet.create for long-lived device connections."""
+    data = parse_body(request)
+    if not hasattr(data, 'get'):
+        return render({'detail': 'JSON parse error'}, status.HTTP_400_BAD_REQUEST)
+
+    errors = {}
+    run_id = data.get('run')
+    run = None
+    if run_id in (None, ''):
+        errors['run'] = [PrimaryKeyRelatedField.default_error_messages['required']]
+    else:
+        run = await get_run(run_id)
+        if run is None:
+            errors['run'] = [PrimaryKeyRelatedField.default_error_messages['does_not_exist'].format(pk_value=run_id)]
+        elif run.status != Run.IN_PROGRESS:
+            errors['run'] = ['Run is not in progress']
+    serializer = PositionFixSerializer(data=data)
+    if not serializer.is_valid():
+        errors.update(serializer.errors)
+    if errors:
+        return render(errors, status.HTTP_400_BAD_REQUEST)
+
+    position = Position(run=run, **serializer.validated_data)
+    last_position = await Position.objects.filter(run=run).order_by('date_time').alast()
+    segment, position.distance, position.speed = await sync_to_async(calculate_position_metrics, thread_sensitive=False)(
+        last_position, position.latitude, position.longitude, position.date_time
+    )
+    await sync_to_async(save_position)(position, segment)
+    return render(PositionSerializer(position).data, status.HTTP_201_CREATED)
+
+
+@csrf_exempt
+@require_POST
+async def start_run(request, run_id):
+    run = await get_run(run_id)
+    if run is None:
+        return render(NOT_FOUND, status.HTTP_404_NOT_FOUND)
+    if run.status != Run.INIT:
+        return render({'message': 'Run already started'}, status.HTTP_400_BAD_REQUEST)
+    run.status = Run.IN_PROGRESS
+    await run.asave()
+    return render(RunSerializer(run).data)
+
+
+@csrf_exempt
+@require_POST
+async def stop_run(request, run_id):
+    run = await get_run(run_id)
+    if run is None:
+        return render(NOT_FOUND, status.HTTP_404_NOT_FOUND)
+    if run.status != Run.IN_PROGRESS:
+        return render({'message': 'Run already finished or not started'}, status.HTTP_400_BAD_REQUEST)
+    run.status = Run.FINISHED
+    run.run_time_seconds = run.get_run_time_seconds()
+    run.speed = run.get_average_speed()
+    await sync_to_async(finish_run)(run)
+    return render(RunSerializer(run).data)
+
+
+async def iter_run_events(run_id):
+    with get_broker().subscribe(run_channel(run_id)) as queue:
+        # the snapshot is read after subscribing so no position falls between the two
+        run = await get_run(run_id)
+        yield format_event(RUN, RunSerializer(run).data)
+        if run.status == Run.FINISHED:
+            return
+        while True:
+            try:
+                message, last = await asyncio.wait_for(queue.get(), settings.LIVE_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield ': keep-alive\n\n'
+                continue
+            yield message
+            if last:
+                return
+
+
+@require_GET
+async def live_run(request, run_id):
+    """Server-sent events with the run snapshot, then each new position and the final run state."""
+    if not isinstance(request, ASGIRequest):
+        # a WSGI server has to consume the whole async stream before sending it, so the events never arrive
+        return render({'detail': 'Live updates require an ASGI server'}, status.HTTP_501_NOT_IMPLEMENTED)
+    if not await Run.objects.filter(pk=run_id).aexists():
+        return render(NOT_FOUND, status.HTTP_404_NOT_FOUND)
+    response = StreamingHttpResponse(iter_run_events(run_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,89 @@
+from django.db.models import Count, Max
+
+from app_run.models import Challenge
+from app_run.stats import Counters, record_finished_run
+
+CHALLENGES_SUMMARY_CACHE_KEY = 'challenges_summary'
+
+
+class ChallengeRule:
+    def __init__(self, full_name, min_runs=None, min_distance=None, max_run_time=None):
+        self.full_name = full_name
+        self.min_runs = min_runs
+        self.min_distance = min_distance
+        self.max_run_time = max_run_time
+
+    def is_met(self, counters, run_time_seconds):
+        if self.min_runs is not None and counters.runs_finished < self.min_runs:
+            return False
+        if self.min_distance is not None and counters.total_distance < self.min_distance:
+            return False
+        if self.max_run_time is not None and run_time_seconds > self.max_run_time:
+            return False
+        return True
+
+    def is_crossed(self, before, after, run_time_seconds):
+        if not self.is_met(after, run_time_seconds):
+            return False
+        if self.max_run_time is not None:
+            return True
+        return not self.is_met(before, run_time_seconds)
+
+
+CHALLENGE_RULES = [
+    ChallengeRule('Сделай 10 Забегов!', min_runs=10),
+    ChallengeRule('Пробеги 50 километров!', min_distance=50.0),
+    ChallengeRule('2 километра за 10 минут!', min_distance=2.0, max_run_time=600),
+]
+
+
+def get_crossed_rules(before, after, run_time_seconds):
+    return [rule.full_name for rule in CHALLENGE_RULES if rule.is_crossed(before, after, run_time_seconds)]
+
+
+def get_challenges_summary_cache_key():
+    """Cache key stamped with the current challenge rows.
+
+    The default cache is per process, so deleting the key on change would leave other
+    processes serving a stale summary; a key that changes with every added or deleted
+    challenge is missed everywhere instead.
+    """
+    stamp = Challenge.objects.aggregate(last_id=Max('id'), count=Count('id'))
+    return f"{CHALLENGES_SUMMARY_CACHE_KEY}:{stamp['last_id']}:{stamp['count']}"
+
+
+def award_challenges(awards):
+    if not awards:
+        return []
+    athlete_ids = {athlete_id for athlete_id, _ in awards}
+    names = {full_name for _, full_name in awards}
+    owned = set(Challenge.objects.filter(athlete__in=athlete_ids, full_name__in=names).values_list('athlete_id', 'full_name'))
+    challenges = [
+        Challenge(athlete_id=athlete_id, full_name=full_name)
+        for athlete_id, full_name in sorted(set(awards))
+        if (athlete_id, full_name) not in owned
+    ]
+    return Challenge.objects.bulk_create(challenges, batch_size=1000)
+
+
+def evaluate_run(run):
+    _, after = record_finished_run(run)
+    # every met rule rather than only the crossed ones, so an award missed while the counters were
+    # not yet backfilled is still given; award_challenges skips challenges the athlete already owns
+    names = [rule.full_name for rule in CHALLENGE_RULES if rule.is_met(after, run.run_time_seconds)]
+    return award_challenges([(run.athlete_id, full_name) for full_name in names])
+
+
+def backfill_challenges(runs):
+    """Award challenges for finished runs given as ordered (athlete_id, distance, run_time_seconds) rows."""
+    awards = set()
+    athlete_id = None
+    counters = Counters(0, 0.0)
+    for run_athlete_id, distance, run_time_seconds in runs:
+        if run_athlete_id != athlete_id:
+            athlete_id = run_athlete_id
+            counters = Counters(0, 0.0)
+        before = counters
+        counters = Counters(before.runs_finished + 1, before.total_distance + distance)
+        awards.update((athlete_id, full_name) for full_name in get_crossed_rules(before, counters, run_time_seconds))
+    return award_challenges(list(awards))
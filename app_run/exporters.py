@@ -0,0 +1,119 @@
+import json
+from itertools import groupby, islice
+from operator import itemgetter
+from xml.sax.saxutils import escape
+
+from django.db.models import Case, IntegerField, When
+
+from app_run.models import Position, Run
+
+GPX = 'gpx'
+GEOJSON = 'geojson'
+EXPORT_CONTENT_TYPES = {
+    GPX: 'application/gpx+xml',
+    GEOJSON: 'application/geo+json',
+}
+CHUNK_SIZE = 2000
+RUNS_BATCH_SIZE = 50
+
+
+def in_order(field, run_ids):
+    return Case(
+        *[When(**{field: run_id}, then=index) for index, run_id in enumerate(run_ids)], output_field=IntegerField(),
+    )
+
+
+def iter_live_points(run_ids):
+    rows = Position.objects.filter(run__in=run_ids).order_by(in_order('run', run_ids), 'created_at', 'id').values_list(
+        'run', 'latitude', 'longitude', 'date_time'
+    ).iterator(chunk_size=CHUNK_SIZE)
+    for run_id, group in groupby(rows, key=itemgetter(0)):
+        yield run_id, (point[1:] for point in group)
+
+
+def iter_archived_points(run_ids):
+    from app_run.archive import iter_track_rows
+
+    # one blob in memory at a time
+    rows = Run.objects.filter(pk__in=run_ids).order_by(in_order('pk', run_ids)).values_list('pk', 'track')
+    for run_id, blob in rows.iterator(chunk_size=1):
+        yield run_id, ((latitude, longitude, date_time) for _, latitude, longitude, date_time, _, _, _ in iter_track_rows(blob))
+
+
+def iter_tracks(runs):
+    """Yield (run, points) pairs, streaming the points of RUNS_BATCH_SIZE runs from one query per storage kind.
+
+    The points of a run must be consumed before the next pair is requested.
+    """
+    runs = iter(runs)
+    while batch := list(islice(runs, RUNS_BATCH_SIZE)):
+        sources = {
+            False: iter_live_points([run.pk for run in batch if run.archived_at is None]),
+            True: iter_archived_points([run.pk for run in batch if run.archived_at is not None]),
+        }
+        pending = {}
+        for run in batch:
+            archived = run.archived_at is not None
+            if archived not in pending:
+                pending[archived] = next(sources[archived], None)
+            # runs without points have no group in the stream
+            if pending[archived] is not None and pending[archived][0] == run.pk:
+                yield run, pending.pop(archived)[1]
+            else:
+                yield run, iter(())
+
+
+def iter_chunks(parts):
+    chunk = []
+    for part in parts:
+        chunk.append(part)
+        if len(chunk) >= CHUNK_SIZE:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+
+def iter_gpx(runs):
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+    yield '<gpx version="1.1" creator="project_run" xmlns="http://www.topografix.com/GPX/1/1">\n'
+    for run, points in iter_tracks(runs):
+        yield f'<trk><name>Run {run.id}</name>'
+        if run.comment:
+            yield f'<desc>{escape(run.comment)}</desc>'
+        yield '<trkseg>\n'
+        for latitude, longitude, date_time in points:
+            if date_time is None:
+                yield f'<trkpt lat="{latitude}" lon="{longitude}"/>\n'
+            else:
+                yield f'<trkpt lat="{latitude}" lon="{longitude}"><time>{date_time.isoformat()}</time></trkpt>\n'
+        yield '</trkseg></trk>\n'
+    yield '</gpx>\n'
+
+
+def iter_geojson(runs):
+    yield '{"type":"FeatureCollection","features":['
+    for index, (run, points) in enumerate(iter_tracks(runs)):
+        properties = {
+            'id': run.id,
+            'athlete': run.athlete_id,
+            'status': run.status,
+            'created_at': run.created_at.isoformat(),
+            'distance': run.distance,
+            'run_time_seconds': run.run_time_seconds,
+            'speed': run.speed,
+        }
+        yield (',' if index else '') + '{"type":"Feature","geometry":{"type":"LineString","coordinates":['
+        # a single pass over the points: coordinates stream out while their times are buffered for coordTimes
+        times = []
+        for point_index, (latitude, longitude, date_time) in enumerate(points):
+            yield f'{"," if point_index else ""}[{longitude},{latitude}]'
+            times.append(json.dumps(date_time.isoformat() if date_time is not None else None))
+        yield ']},"properties":' + json.dumps(properties)[:-1] + ',"coordTimes":[' + ','.join(times) + ']}}'
+    yield ']}\n'
+
+
+def export_runs(runs, export_format):
+    if export_format == GEOJSON:
+        return iter_chunks(iter_geojson(runs))
+    return iter_chunks(iter_gpx(runs))
@@ -1,6 +1,17 @@
+import math
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
 from django.db.models import F, Func, FloatField, ExpressionWrapper, Value
 
 R = 6371000
+GRID_STEP = 0.01
+GRID_COLUMNS = int(360 / GRID_STEP) + 1
+MAX_GRID_CELLS = 1000
+
+GEODESIC = 'geodesic'
+HAVERSINE = 'haversine'
+EQUIRECTANGULAR = 'equirectangular'
 
 
 class Radians(Func):
@@ -33,4 +44,124 @@ def get_distance(lat_a, long_a):
             Sin(Radians(F('latitude')))
         ),
         output_field=FloatField()
-    )
\ No newline at end of file
+    )
+
+
+def haversine(lat_a, long_a, lat_b, long_b):
+    lat_a, long_a, lat_b, long_b = map(math.radians, map(float, (lat_a, long_a, lat_b, long_b)))
+    a = (
+        math.sin((lat_b - lat_a) / 2) ** 2 +
+        math.cos(lat_a) * math.cos(lat_b) * math.sin((long_b - long_a) / 2) ** 2
+    )
+    return 2 * R * math.asin(math.sqrt(min(a, 1.0)))
+
+
+def equirectangular(lat_a, long_a, lat_b, long_b):
+    """Flat-earth approximation, within centimetres of haversine over the few metres between GPS fixes."""
+    lat_a, long_a, lat_b, long_b = map(math.radians, map(float, (lat_a, long_a, lat_b, long_b)))
+    x = (long_b - long_a) * math.cos((lat_a + lat_b) / 2)
+    return R * math.hypot(x, lat_b - lat_a)
+
+
+def geodesic_distance(lat_a, long_a, lat_b, long_b):
+    from geopy.distance import geodesic
+
+    return geodesic((lat_a, long_a), (lat_b, long_b)).meters
+
+
+DISTANCE_BACKENDS = {
+    GEODESIC: geodesic_distance,
+    HAVERSINE: haversine,
+    EQUIRECTANGULAR: equirectangular,
+}
+
+
+def get_distance_backend(name=None):
+    name = name or settings.DISTANCE_BACKEND
+    try:
+        return DISTANCE_BACKENDS[name]
+    except KeyError:
+        raise ImproperlyConfigured(f'Unknown DISTANCE_BACKEND {name!r}, expected one of {", ".join(DISTANCE_BACKENDS)}')
+
+
+def calculate_distance(lat_a, long_a, lat_b, long_b):
+    """Distance in kilometres between two points using the DISTANCE_BACKEND setting."""
+    return get_distance_backend()(lat_a, long_a, lat_b, long_b) / 1000
+
+
+def get_bounding_box(points, radius):
+    lats = [float(lat) for lat, _ in points]
+    longs = [float(long) for _, long in points]
+    delta_lat = math.degrees(radius / R)
+    cos_lat = math.cos(math.radians(min(max(map(abs, lats)) + delta_lat, 89.9)))
+    delta_long = min(delta_lat / cos_lat, 180.0)
+    return (
+        min(lats) - delta_lat,
+        min(longs) - delta_long,
+        max(lats) + delta_lat,
+        max(longs) + delta_long,
+    )
+
+
+def get_cell_row(lat):
+    return int(math.floor((min(max(float(lat), -90.0), 90.0) + 90) / GRID_STEP))
+
+
+def get_cell_column(long):
+    return int(math.floor((min(max(float(long), -180.0), 180.0) + 180) / GRID_STEP))
+
+
+def get_cell(lat, long):
+    return get_cell_row(lat) * GRID_COLUMNS + get_cell_column(long)
+
+
+def get_cells(min_lat, min_long, max_lat, max_long):
+    rows = range(get_cell_row(min_lat), get_cell_row(max_lat) + 1)
+    columns = range(get_cell_column(min_long), get_cell_column(max_long) + 1)
+    if len(rows) * len(columns) > MAX_GRID_CELLS:
+        return None
+    return [row * GRID_COLUMNS + column for row in rows for column in columns]
+
+
+def get_max_radius(lat, step=100):
+    """The largest radius, in steps of metres, whose bounding box stays within MAX_GRID_CELLS at any alignment at lat."""
+    radius = 0
+    while True:
+        min_lat, min_long, max_lat, max_long = get_bounding_box([(lat, 0.0)], radius + step)
+        # a span of n cell widths touches at most n + 2 cells
+        rows = int((max_lat - min_lat) / GRID_STEP) + 2
+        columns = int((max_long - min_long) / GRID_STEP) + 2
+        if rows * columns > MAX_GRID_CELLS:
+            return radius
+        radius += step
+
+
+def filter_by_bounding_box(queryset, min_lat, min_long, max_lat, max_long):
+    cells = get_cells(min_lat, min_long, max_lat, max_long)
+    if cells is not None:
+        queryset = queryset.filter(cell__in=cells)
+    return queryset.filter(
+        latitude__range=(min_lat, max_lat),
+        longitude__range=(min_long, max_long),
+    )
+
+
+def filter_by_distance(queryset, lat, long, radius):
+    queryset = filter_by_bounding_box(queryset, *get_bounding_box([(lat, long)], radius))
+    return queryset.annotate(distance=get_distance(lat, long)).filter(distance__lte=radius)
+
+
+def calculate_speed(start_time, end_time, distance):
+    time = (end_time - start_time).total_seconds()
+    if time != 0:
+        return round(distance * 1000 / time, 2)
+    return 0
+
+
+def calculate_position_metrics(last_position, latitude, longitude, date_time):
+    if last_position is None:
+        return 0, 0, 0
+    d = calculate_distance(last_position.latitude, last_position.longitude, latitude, longitude)
+    distance = round(last_position.distance + d, 2)
+    speed = calculate_speed(start_time=last_position.date_time, end_time=date_time, distance=d)
+    return d, distance, speed
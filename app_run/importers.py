@@ -0,0 +1,224 @@
+import codecs
+import csv
+import os
+import zipfile
+from datetime import timezone as dt_timezone
+from decimal import Decimal, InvalidOperation
+from xml.etree import ElementTree
+
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from app_run.challenges import evaluate_run
+from app_run.helpers import get_cell
+from app_run.models import CollectibleItem, Position, Run
+from app_run.serializers import CollectibleItemSerializer
+from app_run.signals import collect_items_along
+
+COLUMN_NAMES = ['name', 'uid', 'value', 'latitude', 'longitude', 'picture']
+CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+TRACK_EXTENSIONS = ('.gpx', '.csv')
+COORDINATE_PLACES = Decimal('0.0001')
+
+
+class CollectibleItemImportSerializer(CollectibleItemSerializer):
+    class Meta(CollectibleItemSerializer.Meta):
+        extra_kwargs = {'uid': {'validators': []}}
+
+
+class ImportResult:
+    def __init__(self):
+        self.rows_total = 0
+        self.rows_imported = 0
+        self.rows_failed = 0
+        self.errors = []
+
+    @property
+    def errors_truncated(self):
+        return self.rows_failed > len(self.errors)
+
+    def add_error(self, number, row, errors):
+        self.rows_failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'row': number, 'values': list(row), 'errors': errors})
+
+
+def is_csv(file):
+    return (getattr(file, 'name', None) or '').lower().endswith('.csv')
+
+
+def read_csv_rows(file):
+    reader = csv.reader(codecs.iterdecode(file, 'utf-8-sig'))
+    next(reader, None)
+    for number, row in enumerate(reader, start=2):
+        yield number, [value if value != '' else None for value in row]
+
+
+def read_workbook_rows(file):
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
+    try:
+        yield from enumerate(workbook.active.iter_rows(min_row=2, values_only=True), start=2)
+    finally:
+        workbook.close()
+
+
+def read_rows(file):
+    if is_csv(file):
+        return read_csv_rows(file)
+    return read_workbook_rows(file)
+
+
+def import_chunk(rows, result):
+    item_rows = [(number, row, {name: value for name, value in zip(COLUMN_NAMES, row)}) for number, row in rows]
+    uids = [str(item_row['uid']) for _, _, item_row in item_rows if item_row.get('uid') is not None]
+    existing_uids = set(CollectibleItem.objects.filter(uid__in=uids).values_list('uid', flat=True))
+
+    items = {}
+    for number, row, item_row in item_rows:
+        serializer = CollectibleItemImportSerializer(data=item_row)
+        if not serializer.is_valid():
+            result.add_error(number, row, serializer.errors)
+            continue
+        item = CollectibleItem(**serializer.validated_data)
+        if item.uid in existing_uids:
+            result.add_error(number, row, {'uid': ['collectible item with this uid already exists.']})
+            continue
+        if item.uid in items:
+            result.add_error(number, row, {'uid': ['collectible item with this uid appears earlier in the file.']})
+            continue
+        item.cell = get_cell(item.latitude, item.longitude)
+        items[item.uid] = item
+
+    CollectibleItem.objects.bulk_create(
+        items.values(),
+        update_conflicts=True,
+        update_fields=['name', 'value', 'latitude', 'longitude', 'picture', 'cell'],
+        unique_fields=['uid'],
+    )
+    result.rows_imported += len(items)
+
+
+def import_collectible_items(file, chunk_size=CHUNK_SIZE, on_chunk=None):
+    result = ImportResult()
+    chunk = []
+    for number, row in read_rows(file):
+        if all(value is None for value in row):
+            continue
+        result.rows_total += 1
+        chunk.append((number, row))
+        if len(chunk) >= chunk_size:
+            import_chunk(chunk, result)
+            chunk = []
+            if on_chunk is not None:
+                on_chunk(result)
+    if chunk:
+        import_chunk(chunk, result)
+        if on_chunk is not None:
+            on_chunk(result)
+    return result
+
+
+def parse_time(value):
+    if not value:
+        return None
+    date_time = parse_datetime(value.strip())
+    if date_time is None:
+        raise ValueError(f'Invalid time {value!r}')
+    if timezone.is_naive(date_time):
+        date_time = date_time.replace(tzinfo=dt_timezone.utc)
+    return date_time
+
+
+def parse_point(latitude, longitude, date_time):
+    try:
+        point = [Decimal(str(value).strip()).quantize(COORDINATE_PLACES) for value in (latitude, longitude)]
+        # nan parses and quantizes, but cannot be compared with the range below
+        if not all(value.is_finite() for value in point):
+            raise InvalidOperation
+    except InvalidOperation:
+        raise ValueError(f'Invalid coordinates {latitude!r}, {longitude!r}')
+    latitude, longitude = point
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValueError(f'Coordinates out of range {latitude}, {longitude}')
+    return latitude, longitude, parse_time(date_time)
+
+
+def read_gpx_points(file):
+    for _, element in ElementTree.iterparse(file, events=('end',)):
+        if element.tag.rsplit('}', 1)[-1] != 'trkpt':
+            continue
+        time = next((child.text for child in element if child.tag.rsplit('}', 1)[-1] == 'time'), None)
+        yield parse_point(element.get('lat'), element.get('lon'), time)
+        element.clear()
+
+
+def read_csv_points(file):
+    reader = csv.DictReader(codecs.iterdecode(file, 'utf-8-sig'))
+    for row in reader:
+        row = {key.strip().lower(): value for key, value in row.items() if key}
+        yield parse_point(
+            row.get('latitude', row.get('lat')),
+            row.get('longitude', row.get('lon')),
+            row.get('date_time', row.get('time')),
+        )
+
+
+def read_track_points(file, name):
+    if name.lower().endswith('.csv'):
+        return list(read_csv_points(file))
+    return list(read_gpx_points(file))
+
+
+def import_track(athlete, file, name):
+    """Create a finished run with its positions from a GPX or CSV track file."""
+    from app_run.tracks import build_finished_run
+
+    points = read_track_points(file, name)
+    if not points:
+        raise ValueError('Track has no points')
+    points.sort(key=lambda point: (point[2] is None, point[2]))
+    run, positions = build_finished_run(athlete, points, os.path.basename(name))
+    with transaction.atomic():
+        run.save()
+        if run.first_position_at is not None:
+            Run.objects.filter(pk=run.pk).update(created_at=run.first_position_at)
+            run.created_at = run.first_position_at
+        for position in positions:
+            position.run = run
+        Position.objects.bulk_create(positions, batch_size=CHUNK_SIZE)
+        collect_items_along(athlete, [(latitude, longitude) for latitude, longitude, _ in points])
+        evaluate_run(run)
+    return run
+
+
+def iter_track_files(file, name):
+    if name.lower().endswith('.zip'):
+        with zipfile.ZipFile(file) as archive:
+            for member in archive.namelist():
+                if member.lower().endswith(TRACK_EXTENSIONS):
+                    with archive.open(member) as member_file:
+                        yield member_file, member
+    elif name.lower().endswith(TRACK_EXTENSIONS):
+        yield file, name
+
+
+def import_tracks(athlete, file, name):
+    """Import every track in the file or zip archive, with a result per track or a single error for the upload."""
+    results = []
+    try:
+        for track_file, track_name in iter_track_files(file, name):
+            try:
+                run = import_track(athlete, track_file, track_name)
+            except (ValueError, ElementTree.ParseError, csv.Error) as e:
+                results.append({'file': track_name, 'run': None, 'error': str(e)})
+            else:
+                results.append({'file': track_name, 'run': run.id, 'error': None})
+    except zipfile.BadZipFile as e:
+        results.append({'file': name, 'run': None, 'error': str(e)})
+    if not results:
+        results.append({'file': name, 'run': None, 'error': f'No {", ".join(TRACK_EXTENSIONS)} tracks found'})
+    return results
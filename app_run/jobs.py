@@ -0,0 +1,57 @@
+from datetime import timedelta
+
+from django.core.files.base import ContentFile
+from django.db.models import Q
+from django.utils import timezone
+
+from app_run.importers import import_collectible_items
+from app_run.models import UploadJob
+
+
+def requeue_stale_jobs(stale_after):
+    """Hand back running jobs whose worker has not reported progress for stale_after seconds."""
+    cutoff = timezone.now() - timedelta(seconds=stale_after)
+    return UploadJob.objects.filter(
+        Q(heartbeat_at__lt=cutoff) | Q(heartbeat_at__isnull=True, started_at__lt=cutoff),
+        status=UploadJob.RUNNING,
+    ).update(status=UploadJob.PENDING, started_at=None, heartbeat_at=None)
+
+
+def claim_next_job():
+    pending = UploadJob.objects.filter(status=UploadJob.PENDING).order_by('created_at', 'id')
+    for job_id in pending.values_list('id', flat=True)[:10]:
+        now = timezone.now()
+        claimed = UploadJob.objects.filter(pk=job_id, status=UploadJob.PENDING).update(
+            status=UploadJob.RUNNING,
+            started_at=now,
+            heartbeat_at=now,
+        )
+        if claimed:
+            return UploadJob.objects.get(pk=job_id)
+    return None
+
+
+def run_job(job):
+    def report_progress(result):
+        UploadJob.objects.filter(pk=job.pk).update(
+            rows_total=result.rows_total,
+            rows_imported=result.rows_imported,
+            rows_failed=result.rows_failed,
+            heartbeat_at=timezone.now(),
+        )
+
+    try:
+        result = import_collectible_items(ContentFile(bytes(job.file), name=job.file_name), on_chunk=report_progress)
+    except Exception as e:
+        job.status = UploadJob.FAILED
+        job.message = str(e)
+    else:
+        job.status = UploadJob.DONE
+        job.rows_total = result.rows_total
+        job.rows_imported = result.rows_imported
+        job.rows_failed = result.rows_failed
+        job.errors = result.errors
+    job.file = None
+    job.finished_at = timezone.now()
+    job.save()
+    return job
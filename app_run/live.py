@@ -0,0 +1,105 @@
+import asyncio
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from app_run.models import Run
+from app_run.renderers import ORJSONRenderer
+from app_run.serializers import PositionSerializer, RunSerializer
+
+POSITION = 'position'
+RUN = 'run'
+QUEUE_SIZE = 1000
+
+
+class LocalBroker:
+    """In-process pub/sub: events only reach watchers served by the publishing process.
+
+    A broker exposes ``publish(channel, message)`` and ``has_subscribers(channel)``, callable
+    from any thread, and ``subscribe(channel)``, a context manager yielding an asyncio queue of messages.
+    Messages are ``(text, last)`` pairs: a formatted event and whether it ends the stream.
+    """
+
+    def __init__(self, queue_size=QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.lock = threading.Lock()
+        self.subscribers = defaultdict(set)
+
+    @contextmanager
+    def subscribe(self, channel):
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        subscriber = (asyncio.get_running_loop(), queue)
+        with self.lock:
+            self.subscribers[channel].add(subscriber)
+        try:
+            yield queue
+        finally:
+            with self.lock:
+                self.subscribers[channel].discard(subscriber)
+                if not self.subscribers[channel]:
+                    del self.subscribers[channel]
+
+    def has_subscribers(self, channel):
+        with self.lock:
+            return channel in self.subscribers
+
+    def publish(self, channel, message):
+        with self.lock:
+            subscribers = list(self.subscribers.get(channel, ()))
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(self.put, queue, message)
+            except RuntimeError:
+                # the watcher's event loop is already closed
+                pass
+
+    @staticmethod
+    def put(queue, message):
+        # a watcher that cannot keep up loses its oldest events rather than blocking publishers
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(message)
+
+
+@lru_cache(maxsize=None)
+def get_broker():
+    return import_string(settings.LIVE_BROKER)()
+
+
+def run_channel(run_id):
+    return f'run:{run_id}'
+
+
+def format_event(event, data, event_id=None):
+    lines = [f'event: {event}']
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'data: {ORJSONRenderer().render(data).decode()}')
+    return '\n'.join(lines) + '\n\n'
+
+
+def publish_positions(run_id, positions):
+    """Publish saved positions to the run's watchers once the surrounding transaction commits."""
+    def publish():
+        broker = get_broker()
+        channel = run_channel(run_id)
+        # events are only rendered for runs someone is watching
+        if not broker.has_subscribers(channel):
+            return
+        for position in positions:
+            broker.publish(channel, (format_event(POSITION, PositionSerializer(position).data, position.id), False))
+    transaction.on_commit(publish)
+
+
+def publish_run(run):
+    def publish():
+        broker = get_broker()
+        channel = run_channel(run.id)
+        if broker.has_subscribers(channel):
+            broker.publish(channel, (format_event(RUN, RunSerializer(run).data), run.status == Run.FINISHED))
+    transaction.on_commit(publish)
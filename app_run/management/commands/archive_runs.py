@@ -0,0 +1,36 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from app_run.archive import archive_run
+from app_run.models import Run
+
+
+class Command(BaseCommand):
+    help = 'Pack positions of finished runs into compact track blobs and delete the rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int, default=30, help='Only archive runs created before this age')
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--limit', type=int, default=None, help='Stop after archiving this many runs')
+
+    def handle(self, *args, **options):
+        runs = Run.objects.filter(
+            status=Run.FINISHED,
+            track__isnull=True,
+            created_at__lt=timezone.now() - timedelta(days=options['older_than_days']),
+        ).order_by('id').only('id')
+        archived = 0
+        last_id = 0
+        while options['limit'] is None or archived < options['limit']:
+            batch = list(runs.filter(id__gt=last_id)[:options['batch_size']])
+            if not batch:
+                break
+            for run in batch:
+                if options['limit'] is not None and archived >= options['limit']:
+                    break
+                archived += archive_run(run)
+            last_id = batch[-1].id
+            self.stdout.write(f'Archived {archived} runs')
+        self.stdout.write(self.style.SUCCESS(f'Archived {archived} runs'))
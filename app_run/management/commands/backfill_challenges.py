@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from app_run.challenges import backfill_challenges
+from app_run.models import Run
+from app_run.stats import rebuild_athlete_stats
+
+
+class Command(BaseCommand):
+    help = 'Rebuild athlete counters and award challenges for existing finished runs'
+
+    def handle(self, *args, **options):
+        athletes = rebuild_athlete_stats()
+        runs = Run.objects.filter(status=Run.FINISHED).order_by('athlete_id', 'created_at', 'id').values_list(
+            'athlete_id', 'distance', 'run_time_seconds'
+        )
+        challenges = backfill_challenges(runs.iterator(chunk_size=2000))
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt counters for {athletes} athletes, awarded {len(challenges)} challenges'
+        ))
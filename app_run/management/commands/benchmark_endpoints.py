@@ -0,0 +1,149 @@
+import io
+import json
+import platform
+import random
+import statistics
+import time
+import uuid
+from datetime import timedelta
+
+import openpyxl
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from app_run.models import CollectibleItem, Position, Run
+from app_run.management.commands.seed_benchmark_data import USERNAME_PREFIX, random_track
+from app_run.tracks import build_finished_run
+
+User = get_user_model()
+
+ENDPOINTS = [
+    'list_users',
+    'user_detail',
+    'run_stop',
+    'position_create',
+    'challenges_summary',
+    'coach_analytics',
+    'upload_file',
+]
+
+
+class Command(BaseCommand):
+    help = 'Time key API endpoints against the configured database and write JSON results'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--endpoints', nargs='+', choices=ENDPOINTS, default=ENDPOINTS)
+        parser.add_argument('--upload-rows', type=int, default=1000)
+        parser.add_argument('--output', default=None, help='Write results to this JSON file')
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(0)
+        # upload uids must not collide with rows left by an earlier or concurrent invocation
+        self.nonce = uuid.uuid4().hex
+        self.client = Client()
+        self.athlete = User.objects.filter(username__startswith=USERNAME_PREFIX, is_staff=False).order_by('id').first()
+        self.coach = User.objects.filter(username__startswith=USERNAME_PREFIX, is_staff=True).order_by('id').first()
+        if self.athlete is None or self.coach is None:
+            raise CommandError('No benchmark data, run seed_benchmark_data first')
+
+        results = {
+            'created_at': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'python': platform.python_version(),
+            'scale': {
+                'users': User.objects.count(),
+                'runs': Run.objects.count(),
+                'positions': Position.objects.count(),
+                'collectible_items': CollectibleItem.objects.count(),
+            },
+            'endpoints': {},
+        }
+        # everything the benchmark writes is rolled back so the seeded data stays comparable between runs
+        with transaction.atomic():
+            for name in options['endpoints']:
+                result = results['endpoints'][name] = self.benchmark(name, options)
+                self.stdout.write(f"{name}: median {result['median_ms']} ms, {result['queries']} queries")
+            transaction.set_rollback(True)
+
+        output = json.dumps(results, indent=2, ensure_ascii=False)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output)
+        else:
+            self.stdout.write(output)
+
+    def benchmark(self, name, options):
+        timings, queries, status_codes = [], [], set()
+        for index in range(options['repeat']):
+            method, url, data = getattr(self, f'prepare_{name}')(index, options)
+            with CaptureQueriesContext(connection) as context, override_settings(UPLOAD_FILE_ASYNC=False):
+                start = time.perf_counter()
+                response = getattr(self.client, method)(url, data) if data is not None else getattr(self.client, method)(url)
+                timings.append((time.perf_counter() - start) * 1000)
+            queries.append(len(context.captured_queries))
+            status_codes.add(response.status_code)
+        timings.sort()
+        return {
+            'repeat': len(timings),
+            'min_ms': round(timings[0], 3),
+            'median_ms': round(statistics.median(timings), 3),
+            'p95_ms': round(timings[max(0, int(len(timings) * 0.95) - 1)], 3),
+            'max_ms': round(timings[-1], 3),
+            'queries': max(queries),
+            'status_codes': sorted(status_codes),
+        }
+
+    def prepare_list_users(self, index, options):
+        return 'get', '/api/users/?size=50', None
+
+    def prepare_user_detail(self, index, options):
+        user = self.coach if index % 2 else self.athlete
+        return 'get', f'/api/users/{user.id}/', None
+
+    def prepare_run_stop(self, index, options):
+        points = random_track(self.rng, timezone.now() - timedelta(hours=1), 300)
+        run, positions = build_finished_run(self.athlete, points)
+        run.status = Run.IN_PROGRESS
+        run.run_time_seconds, run.speed = 0, 0.0
+        run.save()
+        for position in positions:
+            position.run = run
+        Position.objects.bulk_create(positions)
+        return 'post', f'/api/runs/{run.id}/stop/', None
+
+    def prepare_position_create(self, index, options):
+        if index == 0:
+            self.position_run = Run.objects.create(athlete=self.athlete, status=Run.IN_PROGRESS)
+            self.position_track = random_track(self.rng, timezone.now(), options['repeat'])
+        latitude, longitude, date_time = self.position_track[index]
+        data = {
+            'run': self.position_run.id,
+            'latitude': str(latitude),
+            'longitude': str(longitude),
+            'date_time': date_time.strftime('%Y-%m-%dT%H:%M:%S.%f'),
+        }
+        return 'post', '/api/positions/', data
+
+    def prepare_challenges_summary(self, index, options):
+        cache.clear()
+        return 'get', '/api/challenges_summary/', None
+
+    def prepare_coach_analytics(self, index, options):
+        return 'get', f'/api/analytics_for_coach/{self.coach.id}/', None
+
+    def prepare_upload_file(self, index, options):
+        workbook = openpyxl.Workbook()
+        sheet = workbook.active
+        sheet.append(['Name', 'UID', 'Value', 'Latitude', 'Longitude', 'URL'])
+        for row in range(options['upload_rows']):
+            sheet.append([f'Upload {row}', f'bench-upload-{self.nonce}-{index}-{row}', row, 59.9, 30.3, 'https://example.com/item.png'])
+        content = io.BytesIO()
+        workbook.save(content)
+        return 'post', '/api/upload_file/', {'file': SimpleUploadedFile('items.xlsx', content.getvalue())}
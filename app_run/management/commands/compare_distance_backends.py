@@ -0,0 +1,65 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app_run.helpers import DISTANCE_BACKENDS, GEODESIC
+from app_run.models import Run
+from app_run.tracks import DISTANCE_METHODS, Track
+
+
+class Command(BaseCommand):
+    help = 'Compare distance backends for speed and accuracy against the geodesic on stored tracks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=50, help='Number of most recent finished runs to use')
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        run_ids = list(
+            Run.objects.filter(status=Run.FINISHED, track__isnull=True, positions_count__gt=1)
+            .order_by('-id').values_list('id', flat=True)[:options['runs']]
+        )
+        tracks = [Track.for_run(run_id) for run_id in run_ids]
+        pairs = []
+        reference_totals = []
+        for track in tracks:
+            points = list(zip(track.latitudes.tolist(), track.longitudes.tolist()))
+            run_pairs = [(*a, *b) for a, b in zip(points, points[1:])]
+            pairs.extend(run_pairs)
+            reference_totals.append(sum(DISTANCE_BACKENDS[GEODESIC](*pair) for pair in run_pairs) / 1000)
+        if not pairs:
+            raise CommandError('No finished runs with positions to compare')
+
+        reference = [DISTANCE_BACKENDS[GEODESIC](*pair) for pair in pairs]
+        self.stdout.write(f'{len(run_ids)} runs, {len(pairs)} segments, median segment {statistics.median(reference):.1f} m')
+
+        self.stdout.write('\nPer fix (DISTANCE_BACKEND):')
+        for name, backend in DISTANCE_BACKENDS.items():
+            elapsed = self.best_of(options['repeat'], lambda: [backend(*pair) for pair in pairs])
+            errors = [abs(backend(*pair) - expected) for pair, expected in zip(pairs, reference)]
+            self.stdout.write(
+                f'  {name:16} {elapsed / len(pairs) * 10 ** 6:7.2f} us/segment'
+                f'  mean error {statistics.mean(errors) * 1000:8.3f} mm  max error {max(errors) * 1000:8.3f} mm'
+            )
+
+        self.stdout.write('\nWhole track (numpy):')
+        for name in DISTANCE_METHODS:
+            elapsed = self.best_of(options['repeat'], lambda: [track.segment_distances(name) for track in tracks])
+            errors = [
+                abs(track.distance(name) - expected) / expected * 100
+                for track, expected in zip(tracks, reference_totals) if expected
+            ]
+            self.stdout.write(
+                f'  {name:16} {elapsed / len(pairs) * 10 ** 9:7.1f} ns/segment'
+                f'  max run distance error {max(errors, default=0):.4f} %'
+            )
+
+    @staticmethod
+    def best_of(repeat, function):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function()
+            timings.append(time.perf_counter() - start)
+        return min(timings)
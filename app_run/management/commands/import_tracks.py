@@ -0,0 +1,40 @@
+import os
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from app_run.importers import import_tracks
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Import GPX/CSV track files, directories or zip archives as finished runs of an athlete'
+
+    def add_arguments(self, parser):
+        parser.add_argument('athlete', type=int)
+        parser.add_argument('paths', nargs='+')
+
+    def iter_paths(self, paths):
+        for path in paths:
+            if os.path.isdir(path):
+                for root, _, files in os.walk(path):
+                    for name in sorted(files):
+                        yield os.path.join(root, name)
+            else:
+                yield path
+
+    def handle(self, *args, **options):
+        athlete = User.objects.filter(pk=options['athlete'], is_staff=False).first()
+        if not athlete:
+            raise CommandError('Athlete not found')
+        imported = failed = 0
+        for path in self.iter_paths(options['paths']):
+            with open(path, 'rb') as file:
+                for result in import_tracks(athlete, file, path):
+                    if result['error']:
+                        failed += 1
+                        self.stderr.write(f"{result['file']}: {result['error']}")
+                    else:
+                        imported += 1
+        self.stdout.write(self.style.SUCCESS(f'Imported {imported} runs, {failed} files failed'))
@@ -0,0 +1,71 @@
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+STARTUP_SCRIPT = '''
+import django
+django.setup()
+from django.urls import resolve
+resolve({path!r})
+'''
+
+
+def parse_importtime(output):
+    """Return {module: (self_us, cumulative_us)} from python -X importtime stderr."""
+    modules = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+class Command(BaseCommand):
+    help = 'Measure cold start time and report per-module import times'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--limit', type=int, default=20)
+        parser.add_argument('--path', default='/api/runs/', help='URL resolved after setup, importing its views')
+
+    def handle(self, *args, **options):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', settings.SETTINGS_MODULE))
+        script = STARTUP_SCRIPT.format(path=options['path'])
+        durations = []
+        runs = []
+        for _ in range(options['repeat']):
+            start = time.perf_counter()
+            process = subprocess.run(
+                [sys.executable, '-X', 'importtime', '-c', script], env=env, capture_output=True, text=True,
+            )
+            durations.append(time.perf_counter() - start)
+            if process.returncode:
+                raise CommandError(process.stderr.strip().splitlines()[-1])
+            runs.append(parse_importtime(process.stderr))
+
+        modules = {
+            name: (
+                statistics.median(run[name][0] for run in runs if name in run),
+                statistics.median(run[name][1] for run in runs if name in run),
+            )
+            for name in runs[0]
+        }
+        packages = defaultdict(float)
+        for name, (self_us, _) in modules.items():
+            packages[name.split('.')[0]] += self_us
+
+        self.stdout.write(f"Cold start: median {statistics.median(durations) * 1000:.0f} ms over {options['repeat']} runs")
+        self.stdout.write(f'Imports: {sum(packages.values()) / 1000:.0f} ms in {len(modules)} modules')
+        self.stdout.write('\nSlowest packages (self time):')
+        for name, self_us in sorted(packages.items(), key=lambda item: -item[1])[:options['limit']]:
+            self.stdout.write(f'  {self_us / 1000:8.1f} ms  {name}')
+        self.stdout.write('\nSlowest modules (cumulative time):')
+        for name, (_, cumulative_us) in sorted(modules.items(), key=lambda item: -item[1][1])[:options['limit']]:
+            self.stdout.write(f'  {cumulative_us / 1000:8.1f} ms  {name}')
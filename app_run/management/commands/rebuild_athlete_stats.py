@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from app_run.stats import rebuild_athlete_stats
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the materialized per-athlete statistics from runs, ratings and collected items'
+
+    def handle(self, *args, **options):
+        users = rebuild_athlete_stats()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt statistics for {users} users'))
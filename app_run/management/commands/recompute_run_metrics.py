@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Sum, Min, Max
+
+from app_run.models import Run, Position
+from app_run.tracks import Track
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the running totals kept on runs from their positions (archived runs are skipped)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('run_ids', nargs='*', type=int, help='Only rebuild these runs')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        runs = Run.objects.filter(track__isnull=True).order_by('id')
+        if options['run_ids']:
+            runs = runs.filter(id__in=options['run_ids'])
+        batch_size = options['batch_size']
+        run_ids = list(runs.values_list('id', flat=True))
+        for start in range(0, len(run_ids), batch_size):
+            self.rebuild(run_ids[start:start + batch_size])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt metrics for {len(run_ids)} runs'))
+
+    def rebuild(self, run_ids):
+        totals = {
+            row['run']: row for row in Position.objects.filter(run__in=run_ids).values('run').annotate(
+                positions_count=Count('id'),
+                speed_sum=Sum('speed'),
+                first_position_at=Min('date_time'),
+                last_position_at=Max('date_time'),
+            ).order_by()
+        }
+        runs = list(Run.objects.filter(id__in=run_ids).defer('track'))
+        for run in runs:
+            row = totals.get(run.id, {})
+            run.positions_count = row.get('positions_count', 0)
+            run.speed_sum = row.get('speed_sum') or 0.0
+            run.first_position_at = row.get('first_position_at')
+            run.last_position_at = row.get('last_position_at')
+            run.distance = Track.for_run(run.id).distance() if run.positions_count else 0.0
+            if run.status == Run.FINISHED:
+                run.run_time_seconds = run.get_run_time_seconds()
+                run.speed = run.get_average_speed()
+        Run.objects.bulk_update(runs, [
+            'positions_count',
+            'speed_sum',
+            'first_position_at',
+            'last_position_at',
+            'distance',
+            'run_time_seconds',
+            'speed',
+        ])
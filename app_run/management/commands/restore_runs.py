@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from app_run.archive import restore_run
+from app_run.models import Run
+
+
+class Command(BaseCommand):
+    help = 'Restore position rows of archived runs from their track blobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('run_ids', nargs='+', type=int)
+
+    def handle(self, *args, **options):
+        restored = 0
+        for run in Run.objects.filter(id__in=options['run_ids']).only('id'):
+            restored += restore_run(run)
+        self.stdout.write(self.style.SUCCESS(f'Restored {restored} runs'))
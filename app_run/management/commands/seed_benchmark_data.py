@@ -0,0 +1,137 @@
+import math
+import random
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from app_run.challenges import backfill_challenges
+from app_run.helpers import R, get_cell
+from app_run.models import CollectibleItem, Position, Run, Subscription
+from app_run.signals import collect_items_along
+from app_run.stats import rebuild_athlete_stats
+from app_run.tracks import build_finished_run
+
+User = get_user_model()
+
+USERNAME_PREFIX = 'bench_'
+UID_PREFIX = 'bench-'
+CITY_CENTER = (59.9386, 30.3141)
+CITY_RADIUS = 15000
+COORDINATE_PLACES = Decimal('0.0001')
+
+
+def to_decimal(value):
+    return Decimal(value).quantize(COORDINATE_PLACES)
+
+
+def random_point(rng, center=CITY_CENTER, radius=CITY_RADIUS):
+    distance = radius * math.sqrt(rng.random())
+    bearing = rng.uniform(0, 2 * math.pi)
+    latitude = center[0] + math.degrees(distance * math.cos(bearing) / R)
+    longitude = center[1] + math.degrees(distance * math.sin(bearing) / R) / math.cos(math.radians(center[0]))
+    return latitude, longitude
+
+
+def random_track(rng, started_at, points):
+    """A jogging track: ~2.5-4 m/s with a slowly drifting heading and a fix every 1-5 seconds."""
+    latitude, longitude = random_point(rng)
+    heading = rng.uniform(0, 2 * math.pi)
+    speed = rng.uniform(2.5, 4.0)
+    date_time = started_at
+    track = []
+    for _ in range(points):
+        track.append((to_decimal(latitude), to_decimal(longitude), date_time))
+        interval = rng.randint(1, 5)
+        heading += rng.gauss(0, 0.15)
+        step = max(speed + rng.gauss(0, 0.3), 0.5) * interval
+        latitude += math.degrees(step * math.cos(heading) / R)
+        longitude += math.degrees(step * math.sin(heading) / R) / math.cos(math.radians(latitude))
+        date_time += timedelta(seconds=interval)
+    return track
+
+
+class Command(BaseCommand):
+    help = 'Generate synthetic athletes, coaches, runs with GPS tracks and collectible items for benchmarking'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--athletes', type=int, default=100)
+        parser.add_argument('--coaches', type=int, default=10)
+        parser.add_argument('--runs-per-athlete', type=int, default=20)
+        parser.add_argument('--positions-per-run', type=int, default=300)
+        parser.add_argument('--items', type=int, default=10000)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--clear', action='store_true', help='Delete previously generated data first')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        if options['clear']:
+            User.objects.filter(username__startswith=USERNAME_PREFIX).delete()
+            CollectibleItem.objects.filter(uid__startswith=UID_PREFIX).delete()
+
+        offset = User.objects.filter(username__startswith=USERNAME_PREFIX).count()
+        coaches = User.objects.bulk_create([
+            User(username=f'{USERNAME_PREFIX}coach_{offset + index}', first_name='Coach', last_name=str(index), is_staff=True)
+            for index in range(options['coaches'])
+        ])
+        athletes = User.objects.bulk_create([
+            User(username=f'{USERNAME_PREFIX}athlete_{offset + index}', first_name='Athlete', last_name=str(index))
+            for index in range(options['athletes'])
+        ])
+        self.stdout.write(f'Created {len(coaches)} coaches and {len(athletes)} athletes')
+
+        if coaches:
+            subscriptions = []
+            for athlete in athletes:
+                for coach in rng.sample(coaches, k=min(len(coaches), rng.randint(1, 2))):
+                    subscriptions.append(Subscription(coach=coach, athlete=athlete, rate=rng.choice([None, 1, 2, 3, 4, 5])))
+            Subscription.objects.bulk_create(subscriptions, batch_size=1000)
+            self.stdout.write(f'Created {len(subscriptions)} subscriptions')
+
+        items = []
+        for index in range(options['items']):
+            latitude, longitude = random_point(rng)
+            item = CollectibleItem(
+                name=f'Item {index}',
+                uid=f'{UID_PREFIX}{offset}-{index}',
+                value=rng.randint(1, 100),
+                latitude=to_decimal(latitude),
+                longitude=to_decimal(longitude),
+                picture=f'https://example.com/items/{index}.png',
+            )
+            item.cell = get_cell(item.latitude, item.longitude)
+            items.append(item)
+        CollectibleItem.objects.bulk_create(items, batch_size=2000)
+        self.stdout.write(f'Created {len(items)} collectible items')
+
+        now = timezone.now()
+        runs_created = 0
+        for athlete in athletes:
+            runs = []
+            positions = []
+            for _ in range(options['runs_per_athlete']):
+                started_at = now - timedelta(days=rng.uniform(1, 365))
+                points = random_track(rng, started_at, options['positions_per_run'])
+                run, run_positions = build_finished_run(athlete, points)
+                runs.append(run)
+                positions.append(run_positions)
+            with transaction.atomic():
+                Run.objects.bulk_create(runs)
+                for run, run_positions in zip(runs, positions):
+                    for position in run_positions:
+                        position.run = run
+                Position.objects.bulk_create([position for run_positions in positions for position in run_positions], batch_size=5000)
+                for run_positions in positions:
+                    collect_items_along(athlete, [(position.latitude, position.longitude) for position in run_positions])
+            runs_created += len(runs)
+        self.stdout.write(f'Created {runs_created} runs')
+
+        rebuild_athlete_stats()
+        finished = Run.objects.filter(status=Run.FINISHED).order_by('athlete_id', 'created_at', 'id').values_list(
+            'athlete_id', 'distance', 'run_time_seconds'
+        )
+        challenges = backfill_challenges(finished.iterator(chunk_size=2000))
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt statistics and awarded {len(challenges)} challenges'))
@@ -0,0 +1,163 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, labels, value):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            counts, total = self.series.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect_left(self.buckets, value)] += 1
+            self.series[key] = (counts, total + value)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            series = [(key, list(counts), total) for key, (counts, total) in self.series.items()]
+        for key, counts, total in sorted(series, key=lambda item: str(item[0])):
+            labels = [f'{name}="{value}"' for name, value in key]
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                bucket_labels = ','.join(labels + [f'le="{bound}"'])
+                lines.append(f'{self.name}_bucket{{{bucket_labels}}} {cumulative}')
+            suffix = '{' + ','.join(labels) + '}' if labels else ''
+            lines.append(f'{self.name}_sum{suffix} {total}')
+            lines.append(f'{self.name}_count{suffix} {cumulative}')
+        return lines
+
+
+REQUEST_DURATION = Histogram('app_run_request_duration_seconds', 'Total request time.', LATENCY_BUCKETS)
+REQUEST_SQL_DURATION = Histogram('app_run_request_sql_duration_seconds', 'SQL time spent per request.', LATENCY_BUCKETS)
+REQUEST_QUERIES = Histogram('app_run_request_queries', 'SQL queries executed per request.', QUERY_BUCKETS)
+RESPONSE_SIZE = Histogram('app_run_response_size_bytes', 'Response body size.', SIZE_BUCKETS)
+SECTION_DURATION = Histogram('app_run_section_duration_seconds', 'Time spent in instrumented code sections.', LATENCY_BUCKETS)
+HISTOGRAMS = [REQUEST_DURATION, REQUEST_SQL_DURATION, REQUEST_QUERIES, RESPONSE_SIZE, SECTION_DURATION]
+
+
+class QueryRecorder:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+
+
+@contextmanager
+def timed(section):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        SECTION_DURATION.observe({'section': section}, time.perf_counter() - start)
+
+
+def timed_function(section):
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with timed(section):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def get_view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+    view_name = match.view_name
+    action = getattr(match.func, 'actions', {}).get(request.method.lower())
+    if action and action not in view_name:
+        view_name = f'{view_name}:{action}'
+    return view_name
+
+
+class RequestMetricsMiddleware:
+    """Records per-request view name, SQL query count and time, total time and response size."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        recorder = QueryRecorder()
+        start = time.perf_counter()
+        with wrap_connections(recorder):
+            response = self.get_response(request)
+        return self.record(request, response, recorder, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        # Async views reach the database from the request's sync thread, so the wrappers are installed there.
+        recorder = QueryRecorder()
+        start = time.perf_counter()
+        wrapping = wrap_connections(recorder)
+        await sync_to_async(wrapping.__enter__)()
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(wrapping.__exit__)(None, None, None)
+        return self.record(request, response, recorder, time.perf_counter() - start)
+
+    def record(self, request, response, recorder, duration):
+        labels = {'view': get_view_name(request), 'method': request.method, 'status': response.status_code}
+        REQUEST_DURATION.observe(labels, duration)
+        REQUEST_SQL_DURATION.observe(labels, recorder.duration)
+        REQUEST_QUERIES.observe(labels, recorder.count)
+        if not response.streaming:
+            RESPONSE_SIZE.observe(labels, len(response.content))
+        if settings.REQUEST_METRICS_HEADERS:
+            response['X-Query-Count'] = str(recorder.count)
+            response['Server-Timing'] = (
+                f'total;dur={duration * 1000:.1f}, sql;dur={recorder.duration * 1000:.1f};desc="{recorder.count} queries"'
+            )
+        return response
+
+
+@contextmanager
+def wrap_connections(recorder):
+    wrappers = [connection.execute_wrapper(recorder) for connection in connections.all()]
+    for wrapper in wrappers:
+        wrapper.__enter__()
+    try:
+        yield
+    finally:
+        for wrapper in reversed(wrappers):
+            wrapper.__exit__(None, None, None)
+
+
+def metrics_view(request):
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render())
+    return HttpResponse('\n'.join(lines) + '\n', content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,43 @@
+# Generated by Django 5.2 on 2026-10-18 20:13
+
+import math
+
+from django.db import migrations, models
+
+# frozen copy of app_run.helpers.get_cell at the time of this migration
+GRID_STEP = 0.01
+GRID_COLUMNS = int(360 / GRID_STEP) + 1
+
+
+def get_cell(lat, long):
+    row = int(math.floor((min(max(float(lat), -90.0), 90.0) + 90) / GRID_STEP))
+    column = int(math.floor((min(max(float(long), -180.0), 180.0) + 180) / GRID_STEP))
+    return row * GRID_COLUMNS + column
+
+
+def fill_cells(apps, schema_editor):
+    CollectibleItem = apps.get_model('app_run', 'CollectibleItem')
+    items = []
+    for item in CollectibleItem.objects.only('id', 'latitude', 'longitude').iterator(chunk_size=2000):
+        item.cell = get_cell(item.latitude, item.longitude)
+        items.append(item)
+        if len(items) >= 2000:
+            CollectibleItem.objects.bulk_update(items, ['cell'])
+            items = []
+    CollectibleItem.objects.bulk_update(items, ['cell'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0018_subscription_rate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='collectibleitem',
+            name='cell',
+            field=models.IntegerField(db_index=True, editable=False, null=True),
+        ),
+        migrations.RunPython(fill_cells, migrations.RunPython.noop),
+    ]
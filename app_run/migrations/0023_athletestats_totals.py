@@ -0,0 +1,43 @@
+# Generated by Django 5.2 on 2026-10-18 20:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0022_athletestats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='athletestats',
+            name='items_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='athletestats',
+            name='longest_run',
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.AddField(
+            model_name='athletestats',
+            name='rating_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='athletestats',
+            name='rating_sum',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='athletestats',
+            name='run_speed_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='athletestats',
+            name='run_speed_sum',
+            field=models.FloatField(default=0.0),
+        ),
+    ]
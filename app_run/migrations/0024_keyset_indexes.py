@@ -0,0 +1,43 @@
+# Generated by Django 5.2 on 2026-10-18 20:18
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0023_athletestats_totals'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='challenge',
+            index=models.Index(fields=['created_at', 'id'], name='app_run_cha_created_b8e59d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='challenge',
+            index=models.Index(fields=['athlete', 'created_at', 'id'], name='app_run_cha_athlete_04096b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='position',
+            index=models.Index(fields=['created_at', 'id'], name='app_run_pos_created_00cfa8_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='position',
+            index=models.Index(fields=['run', 'created_at', 'id'], name='app_run_pos_run_id_02460e_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='run',
+            index=models.Index(fields=['created_at', 'id'], name='app_run_run_created_dedccc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='run',
+            index=models.Index(fields=['athlete', 'created_at', 'id'], name='app_run_run_athlete_4cac71_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='run',
+            index=models.Index(fields=['status', 'created_at', 'id'], name='app_run_run_status_5a78b2_idx'),
+        ),
+    ]
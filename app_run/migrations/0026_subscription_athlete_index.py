@@ -0,0 +1,19 @@
+# Generated by Django 5.2 on 2026-10-18 20:30
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0025_run_track'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='subscription',
+            index=models.Index(fields=['athlete', 'created_at', 'id'], name='app_run_sub_athlete_0cebca_idx'),
+        ),
+    ]
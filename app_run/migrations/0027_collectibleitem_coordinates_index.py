@@ -0,0 +1,19 @@
+# Generated by Django 5.2 on 2026-10-18 20:38
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0026_subscription_athlete_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='collectibleitem',
+            index=models.Index(fields=['latitude', 'longitude'], name='app_run_col_latitud_6db97c_idx'),
+        ),
+    ]
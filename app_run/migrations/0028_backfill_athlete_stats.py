@@ -0,0 +1,67 @@
+from django.db import migrations
+from django.db.models import Count, Max, Sum
+
+# frozen copy of app_run.stats.rebuild_athlete_stats at the time of this migration
+
+
+def fill_athlete_stats(apps, schema_editor):
+    Run = apps.get_model('app_run', 'Run')
+    Subscription = apps.get_model('app_run', 'Subscription')
+    CollectibleItem = apps.get_model('app_run', 'CollectibleItem')
+    AthleteStats = apps.get_model('app_run', 'AthleteStats')
+    stats = {}
+
+    def get_stats(athlete_id):
+        if athlete_id not in stats:
+            stats[athlete_id] = AthleteStats(athlete_id=athlete_id)
+        return stats[athlete_id]
+
+    runs = Run.objects.filter(status='finished').values('athlete').annotate(
+        runs_finished=Count('id'),
+        total_distance=Sum('distance'),
+        longest_run=Max('distance'),
+        run_speed_sum=Sum('speed'),
+        run_speed_count=Count('speed'),
+    ).order_by()
+    for row in runs:
+        item = get_stats(row['athlete'])
+        item.runs_finished = row['runs_finished']
+        item.total_distance = row['total_distance'] or 0.0
+        item.longest_run = row['longest_run'] or 0.0
+        item.run_speed_sum = row['run_speed_sum'] or 0.0
+        item.run_speed_count = row['run_speed_count']
+
+    ratings = Subscription.objects.filter(rate__isnull=False).values('coach').annotate(
+        rating_sum=Sum('rate'),
+        rating_count=Count('id'),
+    ).order_by()
+    for row in ratings:
+        item = get_stats(row['coach'])
+        item.rating_sum = row['rating_sum']
+        item.rating_count = row['rating_count']
+
+    items = CollectibleItem.users.through.objects.values('user').annotate(items_count=Count('id')).order_by()
+    for row in items:
+        get_stats(row['user']).items_count = row['items_count']
+
+    AthleteStats.objects.bulk_create(
+        stats.values(),
+        batch_size=1000,
+        update_conflicts=True,
+        unique_fields=['athlete'],
+        update_fields=[
+            'runs_finished', 'total_distance', 'longest_run', 'run_speed_sum', 'run_speed_count',
+            'rating_sum', 'rating_count', 'items_count', 'updated_at',
+        ],
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0027_collectibleitem_coordinates_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_athlete_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,44 @@
+from django.db import migrations
+from django.db.models import Count, Max, Min, Sum
+
+
+def fill_run_totals(apps, schema_editor):
+    Run = apps.get_model('app_run', 'Run')
+    Position = apps.get_model('app_run', 'Position')
+    fields = ['positions_count', 'distance', 'speed_sum', 'first_position_at', 'last_position_at']
+    totals = Position.objects.filter(run__positions_count=0).values(
+        'run', 'run__status', 'run__distance',
+    ).annotate(
+        positions_count=Count('id'),
+        last_distance=Max('distance'),
+        speed_sum=Sum('speed'),
+        first_position_at=Min('date_time'),
+        last_position_at=Max('date_time'),
+    ).order_by()
+    runs = []
+    # fetched in full before updating, the updated runs drop out of the positions_count=0 filter
+    for row in totals:
+        runs.append(Run(
+            pk=row['run'],
+            positions_count=row['positions_count'],
+            # finished runs keep the distance computed when they were stopped, position distances are cumulative
+            distance=row['run__distance'] if row['run__status'] == 'finished' else row['last_distance'] or 0.0,
+            speed_sum=row['speed_sum'] or 0.0,
+            first_position_at=row['first_position_at'],
+            last_position_at=row['last_position_at'],
+        ))
+        if len(runs) >= 2000:
+            Run.objects.bulk_update(runs, fields)
+            runs = []
+    Run.objects.bulk_update(runs, fields)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0028_backfill_athlete_stats'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_run_totals, migrations.RunPython.noop),
+    ]
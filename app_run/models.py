@@ -1,7 +1,10 @@
 from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.db import models
 
+from app_run.helpers import get_cell
+
 
 class Run(models.Model):
     INIT = 'init'
@@ -19,15 +22,36 @@ class Run(models.Model):
     distance = models.FloatField(validators=[MinValueValidator(0.0)], default=0.0)
     run_time_seconds = models.IntegerField(validators=[MinValueValidator(0)], default=0)
     speed = models.FloatField(validators=[MinValueValidator(0.0)], default=0.0, null=True)
+    first_position_at = models.DateTimeField(null=True, blank=True)
+    last_position_at = models.DateTimeField(null=True, blank=True)
+    positions_count = models.IntegerField(validators=[MinValueValidator(0)], default=0)
+    speed_sum = models.FloatField(default=0.0)
+    track = models.BinaryField(null=True, editable=False)
+    archived_at = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['created_at', 'id']),
+            models.Index(fields=['athlete', 'created_at', 'id']),
+            models.Index(fields=['status', 'created_at', 'id']),
+        ]
         verbose_name = 'Run'
         verbose_name_plural = 'Runs'
 
     def __str__(self):
         return f'{self.athlete} - {self.status}'
 
+    def get_run_time_seconds(self):
+        if self.first_position_at is None or self.last_position_at is None:
+            return 0
+        return int((self.last_position_at - self.first_position_at).total_seconds())
+
+    def get_average_speed(self):
+        if not self.positions_count:
+            return None
+        return self.speed_sum / self.positions_count
+
 
 class AthleteInfo(models.Model):
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='athlete_info', primary_key=True)
@@ -50,6 +74,10 @@ class Challenge(models.Model):
 
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['created_at', 'id']),
+            models.Index(fields=['athlete', 'created_at', 'id']),
+        ]
         verbose_name = 'Challenge'
         verbose_name_plural = 'Challenges'
 
@@ -57,6 +85,38 @@ class Challenge(models.Model):
         return f'{self.athlete} - {self.created_at}'
 
 
+class AthleteStats(models.Model):
+    athlete = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='stats', primary_key=True)
+    runs_finished = models.IntegerField(default=0)
+    total_distance = models.FloatField(default=0.0)
+    longest_run = models.FloatField(default=0.0)
+    run_speed_sum = models.FloatField(default=0.0)
+    run_speed_count = models.IntegerField(default=0)
+    rating_sum = models.IntegerField(default=0)
+    rating_count = models.IntegerField(default=0)
+    items_count = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Athlete Stats'
+        verbose_name_plural = 'Athlete Stats'
+
+    def __str__(self):
+        return f'{self.athlete}'
+
+    @property
+    def average_speed(self):
+        if not self.run_speed_count:
+            return None
+        return self.run_speed_sum / self.run_speed_count
+
+    @property
+    def rating(self):
+        if not self.rating_count:
+            return None
+        return self.rating_sum / self.rating_count
+
+
 class Position(models.Model):
     run = models.ForeignKey(Run, on_delete=models.CASCADE, related_name='positions')
     latitude = models.DecimalField(validators=[MinValueValidator(-90.0), MaxValueValidator(90.0)], max_digits=6, decimal_places=4)
@@ -72,6 +132,10 @@ class Position(models.Model):
 
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['created_at', 'id']),
+            models.Index(fields=['run', 'created_at', 'id']),
+        ]
         verbose_name = 'Position'
         verbose_name_plural = 'Positions'
 
@@ -86,17 +150,26 @@ class CollectibleItem(models.Model):
     latitude = models.DecimalField(validators=[MinValueValidator(-90.0), MaxValueValidator(90.0)], max_digits=6, decimal_places=4)
     longitude = models.DecimalField(validators=[MinValueValidator(-180.0), MaxValueValidator(180.0)], max_digits=7, decimal_places=4)
     picture = models.URLField(max_length=250)
+    cell = models.IntegerField(null=True, db_index=True, editable=False)
     users = models.ManyToManyField(settings.AUTH_USER_MODEL, related_name='collectible_items')
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            # range scans for map areas too large for the cell lookup
+            models.Index(fields=['latitude', 'longitude']),
+        ]
         verbose_name = 'Collectible Item'
         verbose_name_plural = 'Collectible Items'
 
     def __str__(self):
         return f'{self.name} - {self.latitude}:{self.longitude}'
 
+    def save(self, *args, **kwargs):
+        self.cell = get_cell(self.latitude, self.longitude)
+        super().save(*args, **kwargs)
+
 
 class Subscription(models.Model):
     coach = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='athletes')
@@ -106,8 +179,44 @@ class Subscription(models.Model):
 
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['athlete', 'created_at', 'id']),
+        ]
         verbose_name = 'Subscription'
         verbose_name_plural = 'Subscriptions'
 
     def __str__(self):
-        return f'{self.coach} - {self.athlete}'
\ No newline at end of file
+        return f'{self.coach} - {self.athlete}'
+
+class UploadJob(models.Model):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+    status = models.CharField(max_length=15, choices=STATUS_CHOICES, default=PENDING)
+    file_name = models.CharField(max_length=255)
+    file = models.BinaryField(null=True)
+    rows_total = models.IntegerField(default=0)
+    rows_imported = models.IntegerField(default=0)
+    rows_failed = models.IntegerField(default=0)
+    errors = models.JSONField(default=list, encoder=DjangoJSONEncoder)
+    message = models.TextField(null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True)
+    heartbeat_at = models.DateTimeField(null=True)
+    finished_at = models.DateTimeField(null=True)
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [models.Index(fields=['status', 'created_at'])]
+        verbose_name = 'Upload Job'
+        verbose_name_plural = 'Upload Jobs'
+
+    def __str__(self):
+        return f'{self.file_name} - {self.status}'
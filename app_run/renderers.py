@@ -0,0 +1,39 @@
+import msgpack
+import orjson
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+# types orjson and msgpack do not know (Decimal, lazy strings, ...) are encoded like DRF's JSONRenderer does
+encode = JSONEncoder().default
+
+
+class ORJSONRenderer(BaseRenderer):
+    media_type = 'application/json'
+    format = 'json'
+    charset = None
+    options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        options = self.options
+        if (renderer_context or {}).get('indent'):
+            options |= orjson.OPT_INDENT_2
+        return orjson.dumps(data, default=encode, option=options)
+
+
+class ColumnarRenderer(ORJSONRenderer):
+    """JSON of parallel arrays, selected with ?format=columnar on views that build such data."""
+    format = 'columnar'
+
+
+class MessagePackRenderer(BaseRenderer):
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=encode, datetime=False)
@@ -3,7 +3,7 @@ from random import choice
 from django.contrib.auth import get_user_model
 from rest_framework import serializers
 
-from app_run.models import Run, AthleteInfo, Challenge, Position, CollectibleItem
+from app_run.models import Run, AthleteInfo, AthleteStats, Challenge, Position, CollectibleItem, UploadJob
 
 User = get_user_model()
 
@@ -43,7 +43,8 @@ class UserSerializer(serializers.ModelSerializer):
         runs_finished = getattr(obj, 'runs_finished', None)
         if runs_finished is not None:
             return runs_finished
-        return Run.objects.filter(athlete=obj, status=Run.FINISHED).count()
+        runs_finished = AthleteStats.objects.filter(athlete=obj).values_list('runs_finished', flat=True).first()
+        return runs_finished or 0
 
     def get_rating(self, obj):
         return getattr(obj, 'rating', None)
@@ -63,6 +64,19 @@ class RunSerializer(serializers.ModelSerializer):
             'run_time_seconds',
             'speed',
         ]
+        # status and totals change only through start/stop, which keep the athlete stats in step
+        read_only_fields = ['status', 'distance', 'run_time_seconds', 'speed']
+
+    def validate_athlete(self, value):
+        if self.instance is not None and value != self.instance.athlete:
+            raise serializers.ValidationError('A run cannot be moved to another athlete')
+        return value
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if instance.status == Run.IN_PROGRESS:
+            data['run_time_seconds'] = instance.get_run_time_seconds()
+        return data
 
 
 class AthleteInfoSerializer(serializers.ModelSerializer):
@@ -107,6 +121,28 @@ class PositionSerializer(serializers.ModelSerializer):
         return value
 
 
+class PositionFixSerializer(serializers.ModelSerializer):
+    date_time = serializers.DateTimeField(format='%Y-%m-%dT%H:%M:%S.%f')
+
+    class Meta:
+        model = Position
+        fields = [
+            'latitude',
+            'longitude',
+            'date_time',
+        ]
+
+
+class PositionBulkSerializer(serializers.Serializer):
+    run = serializers.PrimaryKeyRelatedField(queryset=Run.objects.select_related('athlete'))
+    positions = PositionFixSerializer(many=True, allow_empty=False, max_length=1000)
+
+    def validate_run(self, value):
+        if value.status != Run.IN_PROGRESS:
+            raise serializers.ValidationError('Run is not in progress')
+        return value
+
+
 class CollectibleItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = CollectibleItem
@@ -121,11 +157,49 @@ class CollectibleItemSerializer(serializers.ModelSerializer):
         ]
 
 
+class CollectibleItemDistanceSerializer(CollectibleItemSerializer):
+    distance = serializers.FloatField(read_only=True)
+
+    class Meta(CollectibleItemSerializer.Meta):
+        fields = CollectibleItemSerializer.Meta.fields + ['distance']
+
+
+class UploadJobSerializer(serializers.ModelSerializer):
+    errors_truncated = serializers.SerializerMethodField()
+
+    class Meta:
+        model = UploadJob
+        fields = [
+            'id',
+            'status',
+            'file_name',
+            'rows_total',
+            'rows_imported',
+            'rows_failed',
+            'errors',
+            'errors_truncated',
+            'message',
+            'created_at',
+            'started_at',
+            'finished_at',
+        ]
+
+    def get_errors_truncated(self, obj):
+        return obj.status == UploadJob.DONE and obj.rows_failed > len(obj.errors)
+
+
 class UserDetailSerializer(UserSerializer):
-    items = CollectibleItemSerializer(source='collectible_items', many=True, read_only=True)
+    items_count = serializers.SerializerMethodField()
 
     class Meta(UserSerializer.Meta):
-        fields = UserSerializer.Meta.fields + ['items']
+        fields = UserSerializer.Meta.fields + ['items_count']
+
+    def get_items_count(self, obj):
+        items_count = getattr(obj, 'items_count', None)
+        if items_count is not None:
+            return items_count
+        items_count = AthleteStats.objects.filter(athlete=obj).values_list('items_count', flat=True).first()
+        return items_count or 0
 
 
 class AthleteUserDetailSerializer(UserDetailSerializer):
@@ -135,10 +209,7 @@ class AthleteUserDetailSerializer(UserDetailSerializer):
         fields = UserDetailSerializer.Meta.fields + ['coach']
 
     def get_coach(self, obj):
-        coach = obj.coaches.order_by('?').values('coach_id').first()
-        if coach is not None:
-            return coach.get('coach_id')
-        return None
+        return obj.coaches.order_by('created_at', 'id').values_list('coach_id', flat=True).first()
 
 
 class CoachUserDetailSerializer(UserDetailSerializer):
@@ -1,20 +1,88 @@
-from django.db.models.signals import post_save
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete, m2m_changed
 from django.dispatch import receiver
 
-from app_run.helpers import get_distance
-from app_run.models import Position, CollectibleItem
+from app_run.helpers import filter_by_bounding_box, filter_by_distance, get_bounding_box
+from app_run.metrics import timed_function
+from app_run.models import Position, CollectibleItem, Run, Subscription
+from app_run.stats import add_items_count, refresh_finished_runs, refresh_items_count, refresh_rating
 
 DISTANCE_RAD = 100
 
 @receiver(post_save, sender=Position)
+@timed_function('collect_items')
 def collect_items(sender, instance, created, **kwargs):
-    if not created:
+    if not created or settings.COLLECT_ITEMS_ON_STOP:
         return
-    items = CollectibleItem.objects.annotate(
-      distance=get_distance(instance.latitude, instance.longitude)
-    ).filter(
-        distance__lte=DISTANCE_RAD
-    )
+    items = filter_by_distance(CollectibleItem.objects.all(), instance.latitude, instance.longitude, DISTANCE_RAD)
     user = instance.run.athlete
     user.collectible_items.add(*items)
 
+
+@timed_function('collect_items_along')
+def collect_items_along(user, points):
+    """Give the user every item within DISTANCE_RAD of the points with one insert into the through table."""
+    if not points:
+        return
+    from app_run.tracks import points_near
+
+    candidates = list(filter_by_bounding_box(
+        CollectibleItem.objects.exclude(users=user),
+        *get_bounding_box(points, DISTANCE_RAD),
+    ).values_list('id', 'latitude', 'longitude'))
+    if not candidates:
+        return
+    item_ids, lats, longs = zip(*candidates)
+    near = points_near(lats, longs, [lat for lat, _ in points], [long for _, long in points], DISTANCE_RAD)
+    items = [item_id for item_id, is_near in zip(item_ids, near.tolist()) if is_near]
+    if items:
+        Items = CollectibleItem.users.through
+        Items.objects.bulk_create(
+            [Items(user_id=user.pk, collectibleitem_id=item_id) for item_id in items], ignore_conflicts=True,
+        )
+        # bulk_create sends no m2m_changed, so the denormalized count is refreshed here
+        refresh_items_count([user.pk])
+
+
+def collect_items_for_run(run):
+    """Match the whole track of a run against collectible items, used when COLLECT_ITEMS_ON_STOP is set."""
+    collect_items_along(run.athlete, list(Position.objects.filter(run=run.pk).values_list('latitude', 'longitude')))
+
+
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+def update_coach_rating(sender, instance, **kwargs):
+    refresh_rating(instance.coach_id)
+
+
+@receiver(m2m_changed, sender=CollectibleItem.users.through)
+def update_items_count(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and not reverse:
+        instance._cleared_user_ids = list(instance.users.values_list('id', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if action == 'post_add':
+        # pk_set only holds the newly added rows, empty when everything was already collected
+        if not pk_set:
+            return
+        if reverse:
+            add_items_count([instance.pk], len(pk_set))
+        else:
+            add_items_count(list(pk_set), 1)
+        return
+    # removals may name items the user never had, so the affected users are recounted
+    if reverse:
+        user_ids = [instance.pk] if pk_set or action == 'post_clear' else []
+    elif action == 'post_clear':
+        user_ids = getattr(instance, '_cleared_user_ids', [])
+    else:
+        user_ids = list(pk_set or [])
+    if user_ids:
+        refresh_items_count(user_ids)
+
+
+@receiver(post_delete, sender=Run)
+def forget_finished_run(sender, instance, **kwargs):
+    if instance.status == Run.FINISHED:
+        refresh_finished_runs(instance.athlete_id)
@@ -0,0 +1,147 @@
+from collections import namedtuple
+
+from django.db import transaction
+from django.db.models import Count, F, Max, Sum, Value
+from django.db.models.functions import Coalesce, Greatest, Least
+
+from app_run.models import AthleteStats, CollectibleItem, Run, Subscription
+
+Counters = namedtuple('Counters', ['runs_finished', 'total_distance'])
+
+STATS_FIELDS = [
+    'runs_finished',
+    'total_distance',
+    'longest_run',
+    'run_speed_sum',
+    'run_speed_count',
+    'rating_sum',
+    'rating_count',
+    'items_count',
+]
+
+
+def get_counters(stats):
+    return Counters(stats.runs_finished, stats.total_distance)
+
+
+def record_finished_run(run):
+    with transaction.atomic():
+        stats, _ = AthleteStats.objects.select_for_update().get_or_create(athlete_id=run.athlete_id)
+        before = get_counters(stats)
+        stats.runs_finished += 1
+        stats.total_distance += run.distance
+        stats.longest_run = max(stats.longest_run, run.distance)
+        if run.speed is not None:
+            stats.run_speed_sum += run.speed
+            stats.run_speed_count += 1
+        stats.save()
+    return before, get_counters(stats)
+
+
+def refresh_rating(coach_id):
+    rating = Subscription.objects.filter(coach_id=coach_id, rate__isnull=False).aggregate(
+        rating_sum=Sum('rate'),
+        rating_count=Count('id'),
+    )
+    AthleteStats.objects.update_or_create(athlete_id=coach_id, defaults={
+        'rating_sum': rating['rating_sum'] or 0,
+        'rating_count': rating['rating_count'],
+    })
+
+
+def refresh_items_count(user_ids):
+    Items = CollectibleItem.users.through
+    counts = dict(
+        Items.objects.filter(user_id__in=user_ids).values('user_id').annotate(count=Count('id')).values_list('user_id', 'count').order_by()
+    )
+    for user_id in user_ids:
+        AthleteStats.objects.update_or_create(athlete_id=user_id, defaults={'items_count': counts.get(user_id, 0)})
+
+
+def add_items_count(user_ids, delta):
+    updated = AthleteStats.objects.filter(athlete_id__in=user_ids).update(items_count=F('items_count') + delta)
+    if updated < len(user_ids):
+        # some users have no stats row yet, a recount creates it
+        refresh_items_count(user_ids)
+
+
+def refresh_finished_runs(athlete_id):
+    """Recount the finished run totals of an athlete, e.g. after one of their runs was deleted."""
+    totals = Run.objects.filter(athlete_id=athlete_id, status=Run.FINISHED).aggregate(
+        runs_finished=Count('id'),
+        total_distance=Sum('distance'),
+        longest_run=Max('distance'),
+        run_speed_sum=Sum('speed'),
+        run_speed_count=Count('speed'),
+    )
+    # update rather than create: the athlete may be in the middle of a cascading delete
+    AthleteStats.objects.filter(athlete_id=athlete_id).update(
+        runs_finished=totals['runs_finished'],
+        total_distance=totals['total_distance'] or 0.0,
+        longest_run=totals['longest_run'] or 0.0,
+        run_speed_sum=totals['run_speed_sum'] or 0.0,
+        run_speed_count=totals['run_speed_count'],
+    )
+
+
+def rebuild_athlete_stats():
+    stats = {}
+
+    def get_stats(athlete_id):
+        if athlete_id not in stats:
+            stats[athlete_id] = AthleteStats(athlete_id=athlete_id)
+        return stats[athlete_id]
+
+    runs = Run.objects.filter(status=Run.FINISHED).values('athlete').annotate(
+        runs_finished=Count('id'),
+        total_distance=Sum('distance'),
+        longest_run=Max('distance'),
+        run_speed_sum=Sum('speed'),
+        run_speed_count=Count('speed'),
+    ).order_by()
+    for row in runs:
+        item = get_stats(row['athlete'])
+        item.runs_finished = row['runs_finished']
+        item.total_distance = row['total_distance'] or 0.0
+        item.longest_run = row['longest_run'] or 0.0
+        item.run_speed_sum = row['run_speed_sum'] or 0.0
+        item.run_speed_count = row['run_speed_count']
+
+    ratings = Subscription.objects.filter(rate__isnull=False).values('coach').annotate(
+        rating_sum=Sum('rate'),
+        rating_count=Count('id'),
+    ).order_by()
+    for row in ratings:
+        item = get_stats(row['coach'])
+        item.rating_sum = row['rating_sum']
+        item.rating_count = row['rating_count']
+
+    items = CollectibleItem.users.through.objects.values('user').annotate(items_count=Count('id')).order_by()
+    for row in items:
+        get_stats(row['user']).items_count = row['items_count']
+
+    with transaction.atomic():
+        AthleteStats.objects.exclude(athlete__in=stats.keys()).update(**{
+            field: AthleteStats._meta.get_field(field).default for field in STATS_FIELDS
+        })
+        AthleteStats.objects.bulk_create(
+            stats.values(),
+            batch_size=1000,
+            update_conflicts=True,
+            unique_fields=['athlete'],
+            update_fields=STATS_FIELDS + ['updated_at'],
+        )
+    return len(stats)
+
+
+def update_run_totals(run_id, positions_count, distance, speed_sum, first_time, last_time):
+    totals = {
+        'positions_count': F('positions_count') + positions_count,
+        'distance': F('distance') + distance,
+        'speed_sum': F('speed_sum') + speed_sum,
+    }
+    if first_time is not None:
+        totals['first_position_at'] = Least(Coalesce('first_position_at', Value(first_time)), Value(first_time))
+    if last_time is not None:
+        totals['last_position_at'] = Greatest(Coalesce('last_position_at', Value(last_time)), Value(last_time))
+    Run.objects.filter(pk=run_id).update(**totals)
@@ -1,3 +1,817 @@
-from django.test import TestCase
+import io
+import json
+import math
+import zipfile
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import msgpack
+import openpyxl
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from app_run.archive import archive_run, restore_run
+from app_run.challenges import CHALLENGE_RULES
+from app_run.helpers import DISTANCE_BACKENDS, calculate_distance
+from app_run.importers import MAX_REPORTED_ERRORS
+from app_run.jobs import claim_next_job, requeue_stale_jobs, run_job
+from app_run.live import publish_positions, publish_run
+from app_run.models import AthleteInfo, AthleteStats, Run, Challenge, Position, CollectibleItem, Subscription, UploadJob
+from app_run.serializers import RunSerializer, UploadJobSerializer
+from app_run.stats import Counters, update_run_totals
+from app_run.tracks import Track, build_finished_run
+from app_run.views import MAX_NEARBY_RADIUS
+
+User = get_user_model()
+
+
+class QueryBudgetTests(TestCase):
+    """Every endpoint must run a fixed number of queries, however many rows it returns."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.coach = User.objects.create(username='coach', first_name='Coach', is_staff=True)
+        self.athlete = User.objects.create(username='athlete', first_name='Athlete')
+        self.superuser = User.objects.create_superuser(username='admin', password='admin')
+        self.rows = 0
+        self.add_rows(1)
+
+    def add_rows(self, count):
+        started_at = timezone.now() - timedelta(hours=1)
+        for index in range(self.rows, self.rows + count):
+            athlete = User.objects.create(username=f'athlete_{index}', first_name='Athlete', last_name=str(index))
+            Subscription.objects.create(coach=self.coach, athlete=athlete, rate=index % 5 + 1)
+            run = Run.objects.create(athlete=athlete, status=Run.IN_PROGRESS)
+            for step in range(3):
+                self.client.post('/api/positions/', {
+                    'run': run.id,
+                    'latitude': f'55.{index:02d}{step:02d}',
+                    'longitude': '37.0000',
+                    'date_time': (started_at + timedelta(seconds=step)).strftime('%Y-%m-%dT%H:%M:%S.%f'),
+                }, format='json')
+            self.client.post(f'/api/runs/{run.id}/stop/')
+            Challenge.objects.create(athlete=athlete, full_name=f'Challenge {index % 3}')
+            item = CollectibleItem.objects.create(
+                name=f'Item {index}',
+                uid=f'item-{index}',
+                latitude=Decimal('10.0000') + index,
+                longitude=Decimal('10.0000'),
+                picture='https://example.com/item.png',
+            )
+            item.users.add(self.athlete, self.coach)
+            self.new_run(status=Run.FINISHED, positions=3)
+        self.rows += count
+
+    def new_run(self, status=Run.IN_PROGRESS, positions=0):
+        run = Run.objects.create(athlete=self.athlete, status=status)
+        started_at = timezone.now() - timedelta(minutes=10)
+        Position.objects.bulk_create([
+            Position(run=run, latitude=Decimal('55.0000'), longitude=Decimal('37.0000') + Decimal(step) / 1000,
+                     date_time=started_at + timedelta(seconds=step))
+            for step in range(positions)
+        ])
+        if positions:
+            update_run_totals(run.id, positions, 0.0, 0.0, started_at, started_at + timedelta(seconds=positions - 1))
+        return run
+
+    def count_queries(self, request):
+        cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            response = request()
+        self.assertLess(response.status_code, 400, getattr(response, 'content', b'')[:500])
+        if getattr(response, 'streaming', False):
+            with CaptureQueriesContext(connection) as streaming_context:
+                b''.join(response.streaming_content)
+            return len(context) + len(streaming_context)
+        return len(context)
+
+    def assertQueryBudget(self, budget, request):
+        small = self.count_queries(request)
+        self.add_rows(5)
+        large = self.count_queries(request)
+        self.assertEqual(small, large, 'Query count grows with the number of rows')
+        self.assertLessEqual(large, budget)
+
+    def test_company_details(self):
+        self.assertQueryBudget(0, lambda: self.client.get('/api/company_details/'))
+
+    def test_runs_list(self):
+        self.assertQueryBudget(2, lambda: self.client.get('/api/runs/?size=100'))
+
+    def test_runs_list_cursor(self):
+        self.assertQueryBudget(1, lambda: self.client.get('/api/runs/?pagination=cursor&size=100'))
+
+    def test_run_detail(self):
+        run = self.new_run()
+        self.assertQueryBudget(1, lambda: self.client.get(f'/api/runs/{run.id}/'))
+
+    def test_run_create(self):
+        self.assertQueryBudget(2, lambda: self.client.post('/api/runs/', {'athlete': self.athlete.id}))
+
+    def test_run_start(self):
+        self.assertQueryBudget(3, lambda: self.client.post(f'/api/runs/{self.new_run(status=Run.INIT).id}/start/'))
+
+    def test_run_stop(self):
+        self.assertQueryBudget(11, lambda: self.client.post(f'/api/runs/{self.new_run(positions=5).id}/stop/'))
+
+    @override_settings(COLLECT_ITEMS_ON_STOP=True)
+    def test_run_stop_collecting_items(self):
+        self.assertQueryBudget(13, lambda: self.client.post(f'/api/runs/{self.new_run(positions=5).id}/stop/'))
+
+    def test_run_track(self):
+        run = self.new_run(positions=20)
+        self.assertQueryBudget(2, lambda: self.client.get(f'/api/runs/{run.id}/track/?tolerance=1'))
+
+    def test_run_export(self):
+        run = self.new_run(positions=20)
+        self.assertQueryBudget(2, lambda: self.client.get(f'/api/runs/{run.id}/export/'))
+
+    def test_runs_export(self):
+        # runs, then the positions of each batch of runs
+        self.assertQueryBudget(2, lambda: self.client.get(f'/api/runs_export/?athlete={self.athlete.id}'))
+        self.assertQueryBudget(2, lambda: self.client.get(f'/api/runs_export/?athlete={self.athlete.id}&type=geojson'))
+
+    def test_runs_import(self):
+        def request():
+            track = b'lat,lon,time\n55.0,37.0,2024-01-01T10:00:00\n55.001,37.0,2024-01-01T10:00:10\n'
+            return self.client.post('/api/runs/import/', {
+                'athlete': self.athlete.id,
+                'file': SimpleUploadedFile('track.csv', track),
+            })
+        self.assertQueryBudget(11, request)
+
+    def test_users_list(self):
+        self.assertQueryBudget(2, lambda: self.client.get('/api/users/?size=100'))
+
+    def test_athlete_detail(self):
+        self.assertQueryBudget(2, lambda: self.client.get(f'/api/users/{self.athlete.id}/'))
+
+    def test_coach_detail(self):
+        self.assertQueryBudget(2, lambda: self.client.get(f'/api/users/{self.coach.id}/'))
+
+    def test_user_items(self):
+        self.assertQueryBudget(3, lambda: self.client.get(f'/api/users/{self.athlete.id}/items/?size=100'))
+
+    def test_athlete_info(self):
+        AthleteInfo.objects.create(user=self.athlete)
+        self.assertQueryBudget(2, lambda: self.client.get(f'/api/athlete_info/{self.athlete.id}/'))
+        self.assertQueryBudget(3, lambda: self.client.put(f'/api/athlete_info/{self.athlete.id}/', {'weight': 70}))
+
+    def test_challenges_list(self):
+        self.assertQueryBudget(2, lambda: self.client.get('/api/challenges/?size=100'))
+
+    def test_challenges_summary(self):
+        self.assertQueryBudget(2, lambda: self.client.get('/api/challenges_summary/'))
+
+    def test_positions_list(self):
+        run = self.new_run(positions=20)
+        self.assertQueryBudget(4, lambda: self.client.get(f'/api/positions/?run={run.id}&size=100'))
+
+    def test_position_create(self):
+        run = self.new_run(positions=1)
+        date_times = (timezone.now() + timedelta(seconds=step) for step in range(10))
+
+        def request():
+            return self.client.post('/api/positions/', {
+                'run': run.id,
+                'latitude': '55.0000',
+                'longitude': '37.0010',
+                'date_time': next(date_times).strftime('%Y-%m-%dT%H:%M:%S.%f'),
+            }, format='json')
+        self.assertQueryBudget(8, request)
+
+    def test_positions_bulk(self):
+        run = self.new_run(positions=1)
+        date_times = (timezone.now() + timedelta(seconds=step) for step in range(100))
+
+        def request():
+            positions = [
+                {'latitude': '55.0000', 'longitude': '37.0010', 'date_time': next(date_times).strftime('%Y-%m-%dT%H:%M:%S.%f')}
+                for _ in range(10)
+            ]
+            return self.client.post('/api/positions/bulk/', {'run': run.id, 'positions': positions}, format='json')
+        self.assertQueryBudget(7, request)
+
+    def test_collectible_items_list(self):
+        self.assertQueryBudget(2, lambda: self.client.get('/api/collectible_item/?size=100'))
+
+    def test_collectible_items_near(self):
+        self.assertQueryBudget(1, lambda: self.client.get('/api/collectible_item/?near=12.0,10.0&radius=5000&size=100'))
+
+    def test_upload_file(self):
+        uploads = iter(range(10))
+
+        def request():
+            upload = next(uploads)
+            workbook = openpyxl.Workbook()
+            workbook.active.append(['Name', 'UID', 'Value', 'Latitude', 'Longitude', 'URL'])
+            for row in range(20):
+                workbook.active.append([f'Item {row}', f'upload-{upload}-{row}', row, 10.5, 10.5, 'https://example.com/a.png'])
+            content = io.BytesIO()
+            workbook.save(content)
+            return self.client.post('/api/upload_file/', {'file': SimpleUploadedFile('items.xlsx', content.getvalue())})
+        self.assertQueryBudget(1, request)
+        with override_settings(UPLOAD_FILE_ASYNC=False):
+            self.assertQueryBudget(2, request)
+
+    def test_upload_file_status(self):
+        job = UploadJob.objects.create(file_name='items.xlsx', file=b'')
+        self.assertQueryBudget(1, lambda: self.client.get(f'/api/upload_file/{job.id}/'))
+
+    def test_subscribe_to_coach(self):
+        subscribers = iter(User.objects.bulk_create(User(username=f'subscriber_{index}') for index in range(2)))
+        self.assertQueryBudget(11, lambda: self.client.post(
+            f'/api/subscribe_to_coach/{self.coach.id}/', {'athlete': next(subscribers).id}
+        ))
+
+    def test_rate_coach(self):
+        athlete = User.objects.get(username='athlete_0')
+        self.assertQueryBudget(9, lambda: self.client.post(
+            f'/api/rate_coach/{self.coach.id}/', {'athlete': athlete.id, 'rating': 3}
+        ))
+
+    def test_analytics_for_coach(self):
+        self.assertQueryBudget(2, lambda: self.client.get(f'/api/analytics_for_coach/{self.coach.id}/'))
+
+    def test_metrics(self):
+        self.assertQueryBudget(0, lambda: self.client.get('/api/_metrics'))
+
+    def test_admin_run_changelist(self):
+        self.client.force_login(self.superuser)
+        self.assertQueryBudget(5, lambda: self.client.get('/admin/app_run/run/'))
+
+    def test_admin_collectible_item_changelist(self):
+        self.client.force_login(self.superuser)
+        self.assertQueryBudget(5, lambda: self.client.get('/admin/app_run/collectibleitem/'))
+
+
+class AsyncIngestionTests(TestCase):
+    """The async ingestion views must answer exactly like their DRF counterparts."""
+
+    def setUp(self):
+        self.athlete = User.objects.create(username='athlete')
+        self.started_at = timezone.now() - timedelta(minutes=10)
+
+    def replay(self, position_url, run_url):
+        run = Run.objects.create(athlete=self.athlete)
+        responses = [self.client.post(run_url.format(id=run.id, action='start'))]
+        for step, longitude in enumerate(['37.0000', '37.0010', '37.0030', '37.0030']):
+            responses.append(self.client.post(position_url, {
+                'run': run.id,
+                'latitude': '55.0000',
+                'longitude': longitude,
+                'date_time': (self.started_at + timedelta(seconds=step * 5)).strftime('%Y-%m-%dT%H:%M:%S.%f'),
+            }, content_type='application/json'))
+        responses.append(self.client.post(position_url, {'run': run.id, 'latitude': 'x'}, content_type='application/json'))
+        responses.append(self.client.post(run_url.format(id=run.id, action='stop')))
+        responses.append(self.client.post(run_url.format(id=run.id, action='stop')))
+        ignored = {'id', 'run', 'created_at'}
+        return [
+            (response.status_code, {key: value for key, value in response.json().items() if key not in ignored})
+            for response in responses
+        ]
+
+    def test_matches_sync_views(self):
+        sync = self.replay('/api/positions/', '/api/runs/{id}/{action}/')
+        async_ = self.replay('/api/async/positions/', '/api/async/runs/{id}/{action}/')
+        self.assertEqual(sync, async_)
+        self.assertEqual(
+            list(Run.objects.order_by('id').values_list('distance', 'speed', 'run_time_seconds', 'positions_count')[:1]),
+            list(Run.objects.order_by('-id').values_list('distance', 'speed', 'run_time_seconds', 'positions_count')[:1]),
+        )
+        self.assertEqual(AthleteStats.objects.get(athlete=self.athlete).runs_finished, 2)
+
+
+class LiveRunTests(TestCase):
+    def setUp(self):
+        self.athlete = User.objects.create(username='athlete')
+        self.run = Run.objects.create(athlete=self.athlete, status=Run.IN_PROGRESS)
+
+    def ingest(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            position = Position.objects.create(
+                run=self.run, latitude=Decimal('55.0000'), longitude=Decimal('37.0000'), date_time=timezone.now(),
+            )
+            publish_positions(self.run.id, [position])
+            self.run.status = Run.FINISHED
+            self.run.save()
+            publish_run(self.run)
+        return position
+
+    async def test_stream_follows_run(self):
+        response = await self.async_client.get(f'/api/runs/{self.run.id}/live/')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = aiter(response.streaming_content)
+        self.assertIn(b'"status":"in_progress"', await anext(events))
+        position = await sync_to_async(self.ingest)()
+        self.assertTrue((await anext(events)).startswith(f'event: position\nid: {position.id}\n'.encode()))
+        self.assertIn(b'"status":"finished"', await anext(events))
+        with self.assertRaises(StopAsyncIteration):
+            await anext(events)
+
+    async def test_finished_run_returns_snapshot(self):
+        await Run.objects.filter(pk=self.run.pk).aupdate(status=Run.FINISHED)
+        response = await self.async_client.get(f'/api/runs/{self.run.id}/live/')
+        self.assertEqual([event[:10] async for event in response.streaming_content], [b'event: run'])
+        self.assertEqual((await self.async_client.get('/api/runs/0/live/')).status_code, 404)
+
+    def test_unwatched_runs_are_not_rendered(self):
+        with mock.patch('app_run.live.format_event') as format_event:
+            self.ingest()
+        format_event.assert_not_called()
+
+    def test_requires_asgi(self):
+        self.assertEqual(self.client.get(f'/api/runs/{self.run.id}/live/').status_code, 501)
+
+
+class DistanceBackendTests(TestCase):
+    def test_backends_agree_over_gps_segments(self):
+        segment = (Decimal('55.7558'), Decimal('37.6173'), Decimal('55.7560'), Decimal('37.6178'))
+        expected = calculate_distance(*segment)
+        for backend in DISTANCE_BACKENDS:
+            with self.subTest(backend=backend), override_settings(DISTANCE_BACKEND=backend):
+                self.assertAlmostEqual(calculate_distance(*segment), expected, delta=expected * 0.005)
+
+    @override_settings(DISTANCE_BACKEND='flat')
+    def test_unknown_backend(self):
+        with self.assertRaises(ImproperlyConfigured):
+            calculate_distance(55, 37, 55, 38)
+
+
+class TrackTests(TestCase):
+    def track(self, points):
+        return Track([lat for lat, _ in points], [long for _, long in points], [float(index) for index in range(len(points))])
+
+    def test_keeps_endpoints_and_drops_collinear_points(self):
+        line = [(55.0, 37.0 + step / 1000) for step in range(10)]
+        self.assertEqual(self.track(line).simplify(0.5).tolist(), [0, 9])
+        corner = line + [(55.0 + step / 1000, 37.009) for step in range(1, 10)]
+        self.assertEqual(self.track(corner).simplify(0.5).tolist(), [0, 9, 18])
+
+    def test_tolerance(self):
+        # the middle point is ~11 m off the straight line between its neighbours
+        bump = [(55.0, 37.0), (55.0001, 37.001), (55.0, 37.002)]
+        deviation = 0.0001 * math.pi / 180 * 6371000
+        self.assertEqual(self.track(bump).simplify(deviation - 0.5).tolist(), [0, 1, 2])
+        self.assertEqual(self.track(bump).simplify(deviation + 0.5).tolist(), [0, 2])
+
+    def test_max_points_keeps_largest_errors(self):
+        zigzag = [(55.0, 37.0), (55.0001, 37.001), (55.0, 37.002), (55.001, 37.003), (55.0, 37.004)]
+        self.assertEqual(self.track(zigzag).simplify(1.0).tolist(), [0, 1, 2, 3, 4])
+        self.assertEqual(self.track(zigzag).simplify(1.0, max_points=3).tolist(), [0, 3, 4])
+        self.assertEqual(self.track(zigzag[:2]).simplify(100.0).tolist(), [0, 1])
+
+    def test_build_finished_run(self):
+        started_at = timezone.now()
+        points = [(Decimal('55.0000'), Decimal(f'37.00{step}0'), started_at + timedelta(seconds=10 * step)) for step in range(4)]
+        run, positions = build_finished_run(User.objects.create(username='athlete'), points)
+        segments = [calculate_distance(*a[:2], *b[:2]) for a, b in zip(points, points[1:])]
+        self.assertAlmostEqual(run.distance, sum(segments), places=3)
+        # cumulative distances are rounded to 10 m at each fix
+        self.assertAlmostEqual(positions[-1].distance, sum(segments), delta=0.005 * len(segments))
+        self.assertEqual((run.status, run.positions_count, run.run_time_seconds), (Run.FINISHED, 4, 30))
+        self.assertEqual(positions[0].speed, 0.0)
+        self.assertAlmostEqual(positions[1].speed, segments[0] * 1000 / 10, places=1)
+
+
+class CollectItemsTests(TestCase):
+    def setUp(self):
+        self.athlete = User.objects.create(username='athlete')
+        self.run = Run.objects.create(athlete=self.athlete, status=Run.IN_PROGRESS)
+        self.near = CollectibleItem.objects.create(
+            name='Near', uid='near', latitude=Decimal('55.0005'), longitude=Decimal('37.0000'),
+            picture='https://example.com/near.png',
+        )
+        self.far = CollectibleItem.objects.create(
+            name='Far', uid='far', latitude=Decimal('55.0100'), longitude=Decimal('37.0000'),
+            picture='https://example.com/far.png',
+        )
+
+    def post_positions(self):
+        started_at = timezone.now() - timedelta(minutes=1)
+        for step in range(3):
+            self.client.post('/api/positions/', {
+                'run': self.run.id,
+                'latitude': f'55.000{step}',
+                'longitude': '37.0000',
+                'date_time': (started_at + timedelta(seconds=step)).strftime('%Y-%m-%dT%H:%M:%S.%f'),
+            }, content_type='application/json')
+
+    def test_collects_on_each_position(self):
+        self.post_positions()
+        self.assertEqual(list(self.athlete.collectible_items.all()), [self.near])
+
+    @override_settings(COLLECT_ITEMS_ON_STOP=True)
+    def test_collects_on_stop(self):
+        self.post_positions()
+        self.assertFalse(self.athlete.collectible_items.exists())
+        self.client.post(f'/api/runs/{self.run.id}/stop/')
+        self.assertEqual(list(self.athlete.collectible_items.all()), [self.near])
+        self.assertEqual(AthleteStats.objects.get(athlete=self.athlete).items_count, 1)
+
+
+class NearbyItemsTests(TestCase):
+    def setUp(self):
+        for index, (latitude, longitude) in enumerate([('55.0010', '37.0000'), ('55.0001', '37.0000'), ('55.0500', '37.0000'), ('56.0000', '38.0000')]):
+            CollectibleItem.objects.create(
+                name=f'Item {index}', uid=f'item-{index}', latitude=Decimal(latitude), longitude=Decimal(longitude),
+                picture='https://example.com/item.png',
+            )
+
+    def names(self, query):
+        response = self.client.get(f'/api/collectible_item/?{query}')
+        self.assertEqual(response.status_code, 200, response.content)
+        return [(item['name'], round(item['distance'])) for item in response.json()]
+
+    def test_near(self):
+        self.assertEqual(self.names('near=55.0,37.0&radius=500'), [('Item 1', 11), ('Item 0', 111)])
+
+    def test_nearest(self):
+        self.assertEqual(self.names('near=55.0,37.0&nearest=3&radius=100'), [('Item 1', 11), ('Item 0', 111), ('Item 2', 5560)])
+
+    def test_bbox(self):
+        self.assertEqual([name for name, _ in self.names('bbox=36.9,54.99,37.1,55.01')], ['Item 1', 'Item 0'])
+
+    def test_invalid_query(self):
+        self.assertEqual(self.client.get('/api/collectible_item/?nearest=3').status_code, 400)
+        self.assertEqual(self.client.get('/api/collectible_item/?bbox=1,2,3').status_code, 400)
+
+    def test_search_area_limit(self):
+        self.assertEqual(self.client.get('/api/collectible_item/?bbox=-180,-90,180,90').status_code, 400)
+        self.assertEqual(self.client.get('/api/collectible_item/?near=89.9,0&radius=10000').status_code, 400)
+        for lat in [0, 45, 55.75, 61.67, 64.99]:
+            response = self.client.get(f'/api/collectible_item/?near={lat},37.99&radius={MAX_NEARBY_RADIUS}')
+            self.assertEqual(response.status_code, 200, (lat, response.content))
+        # widening stops at the grid cell limit instead of scanning the table
+        self.assertEqual(self.names('near=55.0,37.0&nearest=4&radius=100'), [('Item 1', 11), ('Item 0', 111), ('Item 2', 5560)])
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        athlete = User.objects.create(username='athlete')
+        Run.objects.bulk_create([Run(athlete=athlete) for _ in range(5)])
+        # equal timestamps are ordered and split by id
+        Run.objects.update(created_at=timezone.now())
+        self.ids = list(Run.objects.order_by('id').values_list('id', flat=True))
+
+    def pages(self, url, link):
+        ids = []
+        while url:
+            data = self.client.get(url).json()
+            ids.append([run['id'] for run in data['results']])
+            url = data[link]
+        return ids
+
+    def test_next_and_previous(self):
+        pages = self.pages('/api/runs/?pagination=cursor&size=2', 'next')
+        self.assertEqual(pages, [self.ids[:2], self.ids[2:4], self.ids[4:]])
+        last = self.client.get('/api/runs/?pagination=cursor&size=2').json()['next']
+        last = self.client.get(last).json()['next']
+        self.assertEqual(self.pages(last, 'previous'), [self.ids[4:], self.ids[2:4], self.ids[:2]])
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get('/api/runs/?size=2&cursor=cD1ub3Q%3D').status_code, 404)
+
+
+class RendererTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        athlete = User.objects.create(username='athlete')
+        self.run = Run.objects.create(athlete=athlete, status=Run.IN_PROGRESS)
+        started_at = timezone.now()
+        self.positions = Position.objects.bulk_create([
+            Position(run=self.run, latitude=Decimal('55.0000'), longitude=Decimal(f'37.000{step}'),
+                     date_time=started_at + timedelta(seconds=step), distance=step / 100, speed=2.5)
+            for step in range(3)
+        ])
+
+    def test_json_matches_drf(self):
+        response = self.client.get(f'/api/runs/{self.run.id}/')
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(response.content, JSONRenderer().render(RunSerializer(self.run).data))
+
+    def test_msgpack(self):
+        response = self.client.get(f'/api/positions/?run={self.run.id}', HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(msgpack.unpackb(response.content), self.client.get(f'/api/positions/?run={self.run.id}').json())
+
+    def test_msgpack_request(self):
+        response = self.client.post('/api/runs/', msgpack.packb({'athlete': self.run.athlete_id}), content_type='application/msgpack')
+        self.assertEqual(response.status_code, 201)
+
+    def test_columnar_positions(self):
+        expected = {
+            'id': [position.id for position in self.positions],
+            'lat': [55.0] * 3,
+            'lon': [37.0, 37.0001, 37.0002],
+            't': [position.date_time.timestamp() for position in self.positions],
+            'distance': [0.0, 0.01, 0.02],
+            'speed': [2.5] * 3,
+        }
+        self.assertEqual(self.client.get(f'/api/positions/?run={self.run.id}&format=columnar').json(), expected)
+        response = self.client.get(f'/api/positions/?run={self.run.id}&format=columnar&size=2').json()
+        self.assertEqual(response['count'], 3)
+        self.assertEqual(response['results']['id'], expected['id'][:2])
+
+    def test_geojson_export(self):
+        response = self.client.get(f'/api/runs/{self.run.id}/export/?type=geojson')
+        feature = json.loads(b''.join(response.streaming_content))['features'][0]
+        self.assertEqual(feature['geometry']['coordinates'], [[37.0, 55.0], [37.0001, 55.0], [37.0002, 55.0]])
+        self.assertEqual(feature['properties']['coordTimes'], [position.date_time.isoformat() for position in self.positions])
+
+    def test_runs_export_streams_each_track(self):
+        Run.objects.filter(pk=self.run.pk).update(status=Run.FINISHED)
+        empty = Run.objects.create(athlete=self.run.athlete, status=Run.FINISHED)
+        # exported by creation time, which here runs against the id order
+        Run.objects.filter(pk=empty.pk).update(created_at=timezone.now() - timedelta(days=1))
+        response = self.client.get(f'/api/runs_export/?athlete={self.run.athlete_id}&type=geojson')
+        features = json.loads(b''.join(response.streaming_content))['features']
+        self.assertEqual([(feature['properties']['id'], len(feature['geometry']['coordinates'])) for feature in features],
+                         [(empty.id, 0), (self.run.id, 3)])
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        self.run = Run.objects.create(athlete=User.objects.create(username='athlete'), status=Run.FINISHED)
+        started_at = timezone.now() - timedelta(days=40)
+        Position.objects.bulk_create([
+            Position(run=self.run, latitude=Decimal('55.0000') + Decimal(step) / 10000, longitude=Decimal(f'-37.00{step}1'),
+                     date_time=None if step == 2 else started_at + timedelta(seconds=step), distance=step * 0.0123,
+                     speed=step * 1.5)
+            for step in range(4)
+        ])
+
+    def views(self):
+        return [
+            self.client.get(f'/api/positions/?run={self.run.id}').json(),
+            self.client.get(f'/api/positions/?run={self.run.id}&size=2&page=2').json(),
+            self.client.get(f'/api/positions/?run={self.run.id}&format=columnar').json(),
+            b''.join(self.client.get(f'/api/runs/{self.run.id}/export/').streaming_content),
+            b''.join(self.client.get(f'/api/runs/{self.run.id}/export/?type=geojson').streaming_content),
+        ]
+
+    def rows(self):
+        return list(Position.objects.filter(run=self.run).order_by('id').values())
+
+    def test_round_trip(self):
+        rows, views = self.rows(), self.views()
+        self.assertTrue(archive_run(self.run))
+        self.assertFalse(Position.objects.filter(run=self.run).exists())
+        self.assertIsNotNone(Run.objects.get(pk=self.run.pk).archived_at)
+        self.assertEqual(self.views(), views)
+        self.assertFalse(archive_run(self.run))
+        self.assertTrue(restore_run(self.run))
+        self.assertEqual(self.rows(), rows)
+        self.assertEqual(self.views(), views)
+        self.assertFalse(restore_run(self.run))
+
+    def test_only_finished_runs(self):
+        Run.objects.filter(pk=self.run.pk).update(status=Run.IN_PROGRESS)
+        self.assertFalse(archive_run(self.run))
+        self.assertEqual(len(self.rows()), 4)
+
+
+class PositionWriteTests(TestCase):
+    def test_positions_are_append_only(self):
+        run = Run.objects.create(athlete=User.objects.create(username='athlete'), status=Run.IN_PROGRESS)
+        position = Position.objects.create(
+            run=run, latitude=Decimal('55.0000'), longitude=Decimal('37.0000'), date_time=timezone.now(),
+        )
+        self.assertEqual(self.client.patch(f'/api/positions/{position.id}/', {'latitude': '56.0000'}, content_type='application/json').status_code, 405)
+        self.assertEqual(self.client.delete(f'/api/positions/{position.id}/').status_code, 405)
+        self.assertTrue(Position.objects.filter(pk=position.pk, latitude=Decimal('55.0000')).exists())
+
+
+class ImportTracksTests(TestCase):
+    track = b'lat,lon,time\n55.0,37.0,2024-01-01T10:00:00\n55.001,37.0,2024-01-01T10:00:10\n'
+
+    def setUp(self):
+        self.athlete = User.objects.create(username='athlete')
+
+    def post(self, name, content):
+        return self.client.post('/api/runs/import/', {'athlete': self.athlete.id, 'file': SimpleUploadedFile(name, content)})
+
+    def test_partial_import(self):
+        content = io.BytesIO()
+        with zipfile.ZipFile(content, 'w') as archive:
+            archive.writestr('good.csv', self.track)
+            archive.writestr('bad.csv', b'lat,lon\nnorth,east\n')
+        response = self.post('tracks.zip', content.getvalue())
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([result['file'] for result in response.json() if result['run']], ['good.csv'])
+
+    def test_nothing_imported(self):
+        for name, content in [('tracks.zip', b'not a zip'), ('track.txt', self.track)]:
+            response = self.post(name, content)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json()[0]['file'], name)
+        self.assertFalse(Run.objects.exists())
+
+    def test_non_finite_coordinates(self):
+        for latitude in ['nan', 'inf', '-Infinity']:
+            response = self.post('track.csv', f'lat,lon\n{latitude},37.0\n'.encode())
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('Invalid coordinates', response.json()[0]['error'])
+
+
+class UploadErrorsTests(TestCase):
+    @override_settings(UPLOAD_FILE_ASYNC=False)
+    def test_reports_truncated_errors(self):
+        rows = ''.join(f'Item {row},uid-{row},1,999,10,https://example.com/a.png\n' for row in range(MAX_REPORTED_ERRORS + 5))
+        file = SimpleUploadedFile('items.csv', ('Name,UID,Value,Latitude,Longitude,URL\n' + rows).encode())
+        response = self.client.post('/api/upload_file/', {'file': file})
+        self.assertEqual(len(response.json()), MAX_REPORTED_ERRORS)
+        self.assertEqual(response['X-Rows-Failed'], str(MAX_REPORTED_ERRORS + 5))
+        self.assertEqual(response['X-Errors-Truncated'], 'true')
+
+    @override_settings(UPLOAD_FILE_ASYNC=False)
+    def test_reports_duplicate_uids(self):
+        rows = ''.join(f'Item {row},uid-{row % 2},1,10,10,https://example.com/a.png\n' for row in range(3))
+        file = SimpleUploadedFile('items.csv', ('Name,UID,Value,Latitude,Longitude,URL\n' + rows).encode())
+        response = self.client.post('/api/upload_file/', {'file': file})
+        self.assertEqual([values[:2] for values in response.json()], [['Item 2', 'uid-0']])
+        self.assertEqual(response['X-Rows-Failed'], '1')
+        self.assertEqual(CollectibleItem.objects.get(uid='uid-0').name, 'Item 0')
+        self.assertEqual(CollectibleItem.objects.count(), 2)
+
+
+class UploadJobWorkerTests(TestCase):
+    def queue(self, content, file_name='items.csv'):
+        return UploadJob.objects.create(file_name=file_name, file=content)
+
+    def test_claim_and_run(self):
+        rows = 'Item 0,uid-0,1,10,10,https://example.com/a.png\nItem 1,uid-1,1,999,10,https://example.com/a.png\n'
+        job = self.queue(('Name,UID,Value,Latitude,Longitude,URL\n' + rows).encode())
+        claimed = claim_next_job()
+        self.assertEqual((claimed.pk, claimed.status), (job.pk, UploadJob.RUNNING))
+        self.assertIsNone(claim_next_job())
+        job = run_job(claimed)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.rows_total, job.rows_imported, job.rows_failed), (UploadJob.DONE, 2, 1, 1))
+        self.assertIsNone(job.file)
+        self.assertEqual(UploadJobSerializer(job).data['errors_truncated'], False)
+
+    def test_failed_job(self):
+        self.queue(b'not a workbook', file_name='items.xlsx')
+        job = run_job(claim_next_job())
+        job.refresh_from_db()
+        self.assertEqual(job.status, UploadJob.FAILED)
+        self.assertTrue(job.message)
+
+    def test_requeue_by_heartbeat(self):
+        long_ago = timezone.now() - timedelta(hours=2)
+        alive = self.queue(b'')
+        stale = self.queue(b'')
+        UploadJob.objects.update(status=UploadJob.RUNNING, started_at=long_ago)
+        # a job started long ago that still reports progress stays with its worker
+        UploadJob.objects.filter(pk=alive.pk).update(heartbeat_at=timezone.now())
+        UploadJob.objects.filter(pk=stale.pk).update(heartbeat_at=long_ago)
+        self.assertEqual(requeue_stale_jobs(1800), 1)
+        self.assertEqual(UploadJob.objects.get(pk=stale.pk).status, UploadJob.PENDING)
+        self.assertEqual(UploadJob.objects.get(pk=alive.pk).status, UploadJob.RUNNING)
+
+
+class ChallengesSummaryCacheTests(TestCase):
+    def summary(self):
+        return {
+            group['name_to_display']: [athlete['username'] for athlete in group['athletes']]
+            for group in self.client.get('/api/challenges_summary/').json()
+        }
+
+    def test_groups_start_with_first_athlete(self):
+        athletes = [User.objects.create(username=f'athlete_{index}') for index in range(3)]
+        for athlete in athletes:
+            Challenge.objects.create(athlete=athlete, full_name='Challenge A')
+        Challenge.objects.create(athlete=athletes[2], full_name='Challenge B')
+        self.assertEqual(self.summary(), {
+            'Challenge A': ['athlete_0', 'athlete_1', 'athlete_2'],
+            'Challenge B': ['athlete_2'],
+        })
+
+    def test_cached_summary_follows_changes(self):
+        athlete = User.objects.create(username='athlete')
+        self.assertEqual(self.summary(), {})
+        # no invalidation hook runs here, as in another process: the stamped key still misses
+        Challenge.objects.bulk_create([Challenge(athlete=athlete, full_name='Challenge')])
+        self.assertEqual(self.summary(), {'Challenge': ['athlete']})
+        Challenge.objects.all().delete()
+        self.assertEqual(self.summary(), {})
+
+
+class ChallengeTests(TestCase):
+    def setUp(self):
+        self.athlete = User.objects.create(username='athlete')
+
+    def finish_run(self, distance=0.0):
+        run = Run.objects.create(athlete=self.athlete, status=Run.IN_PROGRESS, distance=distance)
+        self.assertEqual(self.client.post(f'/api/runs/{run.id}/stop/').status_code, 200)
+
+    def challenges(self):
+        return list(Challenge.objects.filter(athlete=self.athlete).values_list('full_name', flat=True))
+
+    def test_missed_award_given_on_next_run(self):
+        # counters already past the threshold without the challenge, as after the stats backfill
+        AthleteStats.objects.create(athlete=self.athlete, runs_finished=12)
+        self.finish_run()
+        self.assertEqual(self.challenges(), ['Сделай 10 Забегов!'])
+        self.finish_run()
+        self.assertEqual(self.challenges(), ['Сделай 10 Забегов!'])
+
+    def test_threshold_crossing(self):
+        runs, distance, fast = CHALLENGE_RULES
+        self.assertFalse(runs.is_crossed(Counters(8, 0.0), Counters(9, 0.0), 0))
+        self.assertTrue(runs.is_crossed(Counters(9, 0.0), Counters(10, 0.0), 0))
+        self.assertFalse(runs.is_crossed(Counters(10, 0.0), Counters(11, 0.0), 0))
+        self.assertFalse(distance.is_crossed(Counters(1, 40.0), Counters(2, 49.99), 0))
+        self.assertTrue(distance.is_crossed(Counters(1, 45.0), Counters(2, 50.0), 0))
+        self.assertFalse(distance.is_crossed(Counters(1, 50.0), Counters(2, 55.0), 0))
+        # a per-run rule is met again by every fast enough run
+        self.assertTrue(fast.is_crossed(Counters(1, 2.0), Counters(2, 4.0), 600))
+        self.assertFalse(fast.is_crossed(Counters(1, 2.0), Counters(2, 4.0), 601))
+        self.assertFalse(fast.is_crossed(Counters(0, 0.0), Counters(1, 1.99), 300))
+
+    def test_awarded_once(self):
+        for _ in range(9):
+            self.finish_run()
+        self.assertEqual(self.challenges(), [])
+        self.finish_run()
+        self.assertEqual(self.challenges(), ['Сделай 10 Забегов!'])
+        for _ in range(2):
+            self.finish_run(distance=30.0)
+        self.assertCountEqual(self.challenges(), ['Сделай 10 Забегов!', 'Пробеги 50 километров!', '2 километра за 10 минут!'])
+
+    def test_backfill_is_idempotent(self):
+        Run.objects.bulk_create([
+            Run(athlete=self.athlete, status=Run.FINISHED, distance=6.0, run_time_seconds=1200) for _ in range(10)
+        ])
+        for _ in range(2):
+            call_command('backfill_challenges', stdout=io.StringIO())
+            self.assertCountEqual(self.challenges(), ['Сделай 10 Забегов!', 'Пробеги 50 километров!'])
+        stats = AthleteStats.objects.get(athlete=self.athlete)
+        self.assertEqual((stats.runs_finished, stats.total_distance), (10, 60.0))
+
+
+class AthleteStatsSignalTests(TestCase):
+    def setUp(self):
+        self.athlete = User.objects.create(username='athlete')
+        self.items = [
+            CollectibleItem.objects.create(
+                name=f'Item {index}', uid=f'item-{index}', latitude=Decimal('55.0000'), longitude=Decimal('37.0000'),
+                picture='https://example.com/item.png',
+            )
+            for index in range(3)
+        ]
+
+    def items_count(self):
+        return AthleteStats.objects.get(athlete=self.athlete).items_count
+
+    def test_items_count_follows_adds_and_removes(self):
+        self.athlete.collectible_items.add(*self.items[:2])
+        self.assertEqual(self.items_count(), 2)
+        self.items[2].users.add(self.athlete)
+        self.assertEqual(self.items_count(), 3)
+        self.athlete.collectible_items.remove(self.items[0])
+        self.assertEqual(self.items_count(), 2)
+        self.athlete.collectible_items.clear()
+        self.assertEqual(self.items_count(), 0)
+
+    def test_adding_owned_items_is_cheap(self):
+        self.athlete.collectible_items.add(*self.items)
+        # only the lookup of already collected items, no stats refresh
+        with self.assertNumQueries(1):
+            self.athlete.collectible_items.add(*self.items)
+        self.assertEqual(self.items_count(), 3)
+
+    def test_deleting_finished_run_updates_stats(self):
+        runs = [Run.objects.create(athlete=self.athlete, status=Run.IN_PROGRESS) for _ in range(2)]
+        for distance, run in zip([3.0, 5.0], runs):
+            Run.objects.filter(pk=run.pk).update(distance=distance)
+            self.client.post(f'/api/runs/{run.id}/stop/')
+        Run.objects.filter(pk=runs[1].pk).delete()
+        stats = AthleteStats.objects.get(athlete=self.athlete)
+        self.assertEqual((stats.runs_finished, stats.total_distance, stats.longest_run), (1, 3.0, 3.0))
+        self.athlete.delete()
+        self.assertFalse(AthleteStats.objects.exists())
+
+    def test_run_totals_are_read_only(self):
+        run = Run.objects.create(athlete=self.athlete, status=Run.IN_PROGRESS)
+        self.client.post(f'/api/runs/{run.id}/stop/')
+        other = User.objects.create(username='other')
+        response = self.client.patch(f'/api/runs/{run.id}/', {'status': Run.INIT, 'distance': 42.0, 'comment': 'Easy'},
+                                     content_type='application/json')
+        self.assertEqual((response.status_code, response.json()['status'], response.json()['distance']), (200, Run.FINISHED, 0.0))
+        response = self.client.patch(f'/api/runs/{run.id}/', {'athlete': other.id}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        stats = AthleteStats.objects.get(athlete=self.athlete)
+        self.assertEqual((stats.runs_finished, stats.total_distance), (1, 0.0))
@@ -0,0 +1,230 @@
+import heapq
+
+import numpy as np
+from django.conf import settings
+
+from app_run.archive import NULL_TIME, unpack_track
+from app_run.helpers import EQUIRECTANGULAR, GEODESIC, HAVERSINE, R, calculate_speed
+from app_run.models import Position, Run
+
+ELLIPSOID = 'ellipsoid'
+
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+MOVING_SPEED_MIN = 0.5
+NEAR_CHUNK_SIZE = 10 ** 6
+
+
+def haversine_distances(lats, longs):
+    lats = np.radians(lats)
+    longs = np.radians(longs)
+    a = (
+        np.sin(np.diff(lats) / 2) ** 2 +
+        np.cos(lats[:-1]) * np.cos(lats[1:]) * np.sin(np.diff(longs) / 2) ** 2
+    )
+    return 2 * R * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def ellipsoid_distances(lats, longs):
+    """Lambert's formula on the WGS-84 ellipsoid, accurate to metres over thousands of kilometres."""
+    betas = np.arctan((1 - WGS84_F) * np.tan(np.radians(lats)))
+    longs = np.radians(longs)
+    beta_a, beta_b = betas[:-1], betas[1:]
+    a = (
+        np.sin((beta_b - beta_a) / 2) ** 2 +
+        np.cos(beta_a) * np.cos(beta_b) * np.sin(np.diff(longs) / 2) ** 2
+    )
+    sigma = 2 * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+    p = (beta_a + beta_b) / 2
+    q = (beta_b - beta_a) / 2
+    moved = sigma > 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x = (sigma - np.sin(sigma)) * np.sin(p) ** 2 * np.cos(q) ** 2 / np.cos(sigma / 2) ** 2
+        y = (sigma + np.sin(sigma)) * np.cos(p) ** 2 * np.sin(q) ** 2 / np.sin(sigma / 2) ** 2
+    distances = WGS84_A * (sigma - WGS84_F / 2 * (x + y))
+    return np.where(moved, distances, 0.0)
+
+
+def equirectangular_distances(lats, longs):
+    lats = np.radians(lats)
+    longs = np.radians(longs)
+    x = np.diff(longs) * np.cos((lats[:-1] + lats[1:]) / 2)
+    return R * np.hypot(x, np.diff(lats))
+
+
+def points_near(lats, longs, track_lats, track_longs, radius):
+    """Return a mask of the points lying within radius metres (haversine) of any track point."""
+    lats = np.radians(np.asarray(lats, dtype=float))[:, np.newaxis]
+    longs = np.radians(np.asarray(longs, dtype=float))[:, np.newaxis]
+    track_lats = np.radians(np.asarray(track_lats, dtype=float))
+    track_longs = np.radians(np.asarray(track_longs, dtype=float))
+    near = np.zeros(len(lats), dtype=bool)
+    # compare against the track in slices to bound the points x track distance matrix
+    step = max(1, NEAR_CHUNK_SIZE // max(len(lats), 1))
+    for start in range(0, len(track_lats), step):
+        chunk_lats = track_lats[start:start + step]
+        chunk_longs = track_longs[start:start + step]
+        a = (
+            np.sin((chunk_lats - lats) / 2) ** 2 +
+            np.cos(lats) * np.cos(chunk_lats) * np.sin((chunk_longs - longs) / 2) ** 2
+        )
+        near |= (2 * R * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0))) <= radius).any(axis=1)
+    return near
+
+
+DISTANCE_METHODS = {
+    HAVERSINE: haversine_distances,
+    ELLIPSOID: ellipsoid_distances,
+    EQUIRECTANGULAR: equirectangular_distances,
+    # Lambert's formula agrees with the geodesic to millimetres over GPS segments
+    GEODESIC: ellipsoid_distances,
+}
+
+
+class Track:
+    def __init__(self, latitudes, longitudes, times):
+        self.latitudes = np.asarray(latitudes, dtype=float)
+        self.longitudes = np.asarray(longitudes, dtype=float)
+        self.times = np.asarray(times, dtype=float)
+
+    @classmethod
+    def from_rows(cls, rows):
+        rows = list(rows)
+        return cls(
+            [row[0] for row in rows],
+            [row[1] for row in rows],
+            [row[2].timestamp() if row[2] is not None else np.nan for row in rows],
+        )
+
+    @classmethod
+    def for_run(cls, run_id):
+        rows = Position.objects.filter(run=run_id).order_by('date_time', 'id').values_list(
+            'latitude', 'longitude', 'date_time'
+        )
+        return cls.from_rows(rows)
+
+    @classmethod
+    def from_archive(cls, blob):
+        columns = unpack_track(blob)
+        order = np.lexsort((columns['id'], columns['date_time']))
+        times = columns['date_time'][order]
+        return cls(
+            columns['latitude'][order],
+            columns['longitude'][order],
+            np.where(times == NULL_TIME, np.nan, times / 10 ** 6),
+        )
+
+    @classmethod
+    def load(cls, run):
+        if run.archived_at is not None:
+            return cls.from_archive(Run.objects.filter(pk=run.pk).values_list('track', flat=True).get())
+        return cls.for_run(run.id)
+
+    def __len__(self):
+        return len(self.latitudes)
+
+    def segment_distances(self, method=None):
+        if len(self) < 2:
+            return np.zeros(0)
+        return DISTANCE_METHODS[method or settings.DISTANCE_BACKEND](self.latitudes, self.longitudes)
+
+    def segment_durations(self):
+        if len(self) < 2:
+            return np.zeros(0)
+        return np.diff(self.times)
+
+    def distance(self, method=None):
+        return float(self.segment_distances(method).sum()) / 1000
+
+    def duration(self):
+        times = self.times[~np.isnan(self.times)]
+        if not len(times):
+            return 0
+        return float(times.max() - times.min())
+
+    def moving_speed(self, method=None):
+        distances = self.segment_distances(method)
+        durations = self.segment_durations()
+        valid = durations > 0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            moving = valid & (distances / durations >= MOVING_SPEED_MIN)
+        total_time = durations[moving].sum()
+        if not total_time:
+            return 0.0
+        return round(float(distances[moving].sum() / total_time), 2)
+
+    def points(self, indices):
+        """Return [latitude, longitude, seconds since the first fix] rows for the given indices."""
+        times = self.times[~np.isnan(self.times)]
+        start = times.min() if len(times) else 0
+        return [
+            [lat, lon, None if np.isnan(time) else round(time - start, 3)]
+            for lat, lon, time in zip(
+                self.latitudes[indices].tolist(),
+                self.longitudes[indices].tolist(),
+                self.times[indices].tolist(),
+            )
+        ]
+
+    def simplify(self, tolerance, max_points=None):
+        """Return indices of the points kept by Douglas-Peucker.
+
+        Splits are taken in order of decreasing error, so max_points keeps the most significant points.
+        """
+        if len(self) < 3:
+            return np.arange(len(self))
+        y = np.radians(self.latitudes) * R
+        x = np.radians(self.longitudes) * R * np.cos(np.radians(self.latitudes.mean()))
+
+        def farthest(start, end):
+            dx, dy = x[end] - x[start], y[end] - y[start]
+            px, py = x[start + 1:end] - x[start], y[start + 1:end] - y[start]
+            length = dx * dx + dy * dy
+            t = np.clip((px * dx + py * dy) / length, 0.0, 1.0) if length else np.zeros(len(px))
+            distances = np.hypot(px - t * dx, py - t * dy)
+            index = int(distances.argmax())
+            return -float(distances[index]), start, end, start + 1 + index
+
+        keep = [0, len(self) - 1]
+        heap = [farthest(0, len(self) - 1)]
+        while heap and (max_points is None or len(keep) < max_points):
+            error, start, end, index = heapq.heappop(heap)
+            if -error <= tolerance:
+                break
+            keep.append(index)
+            for segment in ((start, index), (index, end)):
+                if segment[1] - segment[0] > 1:
+                    heapq.heappush(heap, farthest(*segment))
+        return np.array(sorted(keep))
+
+
+def build_finished_run(athlete, points, comment=None):
+    """Build an unsaved finished run and its positions from ordered (latitude, longitude, date_time) points."""
+    date_times = [date_time for _, _, date_time in points if date_time is not None]
+    segments = Track.from_rows(points).segment_distances() / 1000
+
+    positions = []
+    last_position = None
+    for index, (latitude, longitude, date_time) in enumerate(points):
+        position = Position(latitude=latitude, longitude=longitude, date_time=date_time)
+        if last_position is not None:
+            segment = float(segments[index - 1])
+            position.distance = round(last_position.distance + segment, 2)
+            if date_time is not None and last_position.date_time is not None:
+                position.speed = calculate_speed(last_position.date_time, date_time, segment)
+        positions.append(position)
+        last_position = position
+
+    run = Run(
+        athlete=athlete,
+        status=Run.FINISHED,
+        comment=comment,
+        distance=float(segments.sum()),
+        positions_count=len(positions),
+        speed_sum=sum(position.speed for position in positions),
+        first_position_at=min(date_times, default=None),
+        last_position_at=max(date_times, default=None),
+    )
+    run.run_time_seconds = run.get_run_time_seconds()
+    run.speed = run.get_average_speed()
+    return run, positions
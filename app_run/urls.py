@@ -1,15 +1,19 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 
+from app_run.async_views import create_position, live_run, start_run, stop_run
+from app_run.metrics import metrics_view
 from app_run.views import (
     company_details,
     RunViewSet,
+    RunsExportView,
     UserViewSet,
     AthleteInfoApiView,
     ChallengeViewSet,
     PositionViewSet,
     CollectibleItemViewSet,
     UploadCollectibleItemFileView,
+    UploadJobStatusView,
     SubscribeToCoachView,
     ChallengesSummaryView,
     RateCoachView,
@@ -26,10 +30,17 @@ router.register('collectible_item', CollectibleItemViewSet, basename='collectibl
 urlpatterns = [
     path('company_details/', company_details, name='company_details'),
     path('athlete_info/<int:user_id>/', AthleteInfoApiView.as_view(), name='athlete_info'),
+    path('runs_export/', RunsExportView.as_view(), name='runs_export'),
     path('upload_file/', UploadCollectibleItemFileView.as_view(), name='upload_file'),
+    path('upload_file/<int:job_id>/', UploadJobStatusView.as_view(), name='upload_file_status'),
     path('subscribe_to_coach/<int:coach_id>/', SubscribeToCoachView.as_view(), name='subscribe_to_coach'),
     path('challenges_summary/', ChallengesSummaryView.as_view(), name='challenges_summary'),
     path('rate_coach/<int:coach_id>/', RateCoachView.as_view(), name='rate_coach'),
     path('analytics_for_coach/<int:coach_id>/', AnalyticsForCoachView.as_view(), name='analytics_for_coach'),
+    path('_metrics', metrics_view, name='metrics'),
+    path('async/positions/', create_position, name='async_position_create'),
+    path('async/runs/<int:run_id>/start/', start_run, name='async_run_start'),
+    path('async/runs/<int:run_id>/stop/', stop_run, name='async_run_stop'),
+    path('runs/<int:run_id>/live/', live_run, name='run_live'),
     path('', include(router.urls)),
 ]
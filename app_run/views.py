@@ -1,27 +1,43 @@
+from datetime import datetime
 
-import openpyxl
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db.models import Q, Count, Sum, Max, Min, Avg, FloatField
+from django.db import transaction
+from django.db.models import Case, F, FloatField, Q, When
+from django.db.models.functions import Cast, Coalesce
+from django.http import StreamingHttpResponse
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import viewsets, status, serializers
 from rest_framework.decorators import api_view, action
+from rest_framework.exceptions import NotFound
 from rest_framework.filters import SearchFilter, OrderingFilter
 from rest_framework.generics import get_object_or_404
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import Cursor, CursorPagination, PageNumberPagination
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.views import APIView
-from geopy.distance import geodesic
 
+from app_run.challenges import evaluate_run, get_challenges_summary_cache_key
+from app_run.exporters import EXPORT_CONTENT_TYPES, GPX, export_runs
+from app_run.helpers import (
+    MAX_GRID_CELLS, calculate_position_metrics, filter_by_bounding_box, get_bounding_box, get_cells, get_max_radius,
+    haversine,
+)
+from app_run.importers import import_collectible_items, import_tracks
+from app_run.live import publish_positions, publish_run
 from app_run.models import (
     Run,
     AthleteInfo,
+    AthleteStats,
     Challenge,
     Position,
     CollectibleItem,
     Subscription,
+    UploadJob,
 )
+from app_run.renderers import ColumnarRenderer
 from app_run.serializers import (
     RunSerializer,
     UserSerializer,
@@ -29,28 +45,98 @@ from app_run.serializers import (
     ChallengeSerializer,
     PositionSerializer,
     CollectibleItemSerializer,
+    CollectibleItemDistanceSerializer,
     AthleteUserDetailSerializer,
     CoachUserDetailSerializer,
     ChallengeSummarySerializer,
+    PositionBulkSerializer,
+    UploadJobSerializer,
 )
+from app_run.signals import collect_items_along, collect_items_for_run
+from app_run.stats import update_run_totals
 
 User = get_user_model()
 
-def calculate_distance(positions):
-    way = [(position.latitude, position.longitude) for position in positions]
-    return geodesic(*way).kilometers
+# near=lat,lon searches up to this radius stay within the grid cell index anywhere below MAX_NEARBY_LATITUDE
+MAX_NEARBY_LATITUDE = 65.0
+MAX_NEARBY_RADIUS = get_max_radius(MAX_NEARBY_LATITUDE)
 
+class PagePagination(PageNumberPagination):
+    page_size_query_param = 'size'
+    max_page_size = 100
 
-def calculate_speed(start_time, end_time, distance):
-    time = (end_time - start_time).total_seconds()
-    if time != 0:
-        return round(distance * 1000 / time, 2)
-    return 0
 
+class KeysetPagination(CursorPagination):
+    """Cursor pagination seeking past the (created_at, id) pair of the last row seen.
 
-class PagePagination(PageNumberPagination):
+    DRF's cursor keeps only created_at plus an offset into equal timestamps, so a page
+    is filtered here with created_at > x OR (created_at = x AND id > y) instead, which
+    the (created_at, id) indexes serve at any depth.
+    """
     page_size_query_param = 'size'
     max_page_size = 100
+    ordering = ('created_at', 'id')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor is not None and self.cursor.reverse
+        position = self.cursor and self.decode_position(self.cursor.position)
+        if position is not None:
+            created_at, pk = position
+            if reverse:
+                queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, pk__lt=pk))
+            else:
+                queryset = queryset.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, pk__gt=pk))
+        queryset = queryset.order_by(*(('-created_at', '-id') if reverse else self.ordering))
+
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        has_more = len(results) > self.page_size
+        if reverse:
+            self.page.reverse()
+        # an empty page has no row to seek back from
+        self.has_next = has_more if not reverse else bool(self.page)
+        self.has_previous = has_more if reverse else position is not None and bool(self.page)
+        if self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    def decode_position(self, value):
+        if value is None:
+            return None
+        try:
+            created_at, pk = value.split('|')
+            return datetime.fromisoformat(created_at), int(pk)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_link(self, item, reverse):
+        return self.encode_cursor(Cursor(offset=0, reverse=reverse, position=f'{item.created_at.isoformat()}|{item.pk}'))
+
+    def get_next_link(self):
+        return self.get_link(self.page[-1], reverse=False) if self.has_next else None
+
+    def get_previous_link(self):
+        return self.get_link(self.page[0], reverse=True) if self.has_previous else None
+
+
+class KeysetPaginationMixin:
+    """Switches to keyset pagination on (created_at, id) for ?pagination=cursor and cursor links."""
+    keyset_pagination_class = KeysetPagination
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator') and self.request is not None:
+            params = self.request.query_params
+            if params.get('pagination') == 'cursor' or self.keyset_pagination_class.cursor_query_param in params:
+                self._paginator = self.keyset_pagination_class()
+        return super().paginator
 
 
 @api_view(['GET'])
@@ -63,20 +149,8 @@ def company_details(request):
     return Response(company_info)
 
 
-def calculate_time(run_id):
-    try:
-        times = Position.objects.filter(run=run_id).aggregate(
-            start_time=Min('date_time'),
-            end_time=Max('date_time'),
-        )
-        return (times['end_time'] - times['start_time']).total_seconds()
-    except TypeError as e:
-        print(e)
-        return 0
-
-
-class RunViewSet(viewsets.ModelViewSet):
-    queryset = Run.objects.all().select_related('athlete')
+class RunViewSet(KeysetPaginationMixin, viewsets.ModelViewSet):
+    queryset = Run.objects.all().select_related('athlete').defer('track')
     serializer_class = RunSerializer
     filter_backends = [DjangoFilterBackend, OrderingFilter]
     filterset_fields = ['status', 'athlete']
@@ -99,30 +173,114 @@ class RunViewSet(viewsets.ModelViewSet):
         if run.status != Run.IN_PROGRESS:
             return Response({'message': 'Run already finished or not started'}, status=400)
         run.status = Run.FINISHED
-        run.run_time_seconds = calculate_time(run_id=run.id)
-        run.distance = calculate_distance(run.positions.all())
-        run.speed = run.positions.aggregate(speed=Avg('speed')).get('speed', 0.0)
-        run.save()
-        self.create_challenge(run)
+        run.run_time_seconds = run.get_run_time_seconds()
+        run.speed = run.get_average_speed()
+        with transaction.atomic():
+            run.save(update_fields=['status', 'run_time_seconds', 'speed'])
+            evaluate_run(run)
+            if settings.COLLECT_ITEMS_ON_STOP:
+                collect_items_for_run(run)
+            publish_run(run)
         return Response(RunSerializer(run).data, status=200)
 
-    def create_challenge(self, run):
-        runs_finished = Run.objects.filter(athlete=run.athlete, status=Run.FINISHED).aggregate(
-            distance_sum=Sum('distance'), count=Count('id')
-        )
-        if runs_finished.get('count', 0) == 10:
-            Challenge.objects.get_or_create(athlete=run.athlete, full_name='Сделай 10 Забегов!')
-        if runs_finished.get('distance_sum', 0.0) >= 50.0:
-            Challenge.objects.get_or_create(athlete=run.athlete, full_name='Пробеги 50 километров!')
-        if runs_finished.get('distance_sum', 0.0) >= 2.0 and run.run_time_seconds <= 600:
-            Challenge.objects.get_or_create(athlete=run.athlete, full_name='2 километра за 10 минут!')
+    @action(detail=True, methods=['get'])
+    def export(self, request, pk=None):
+        run = self.get_object()
+        query = ExportQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        return export_response([run], query.validated_data['type'], f'run_{run.id}')
+
+    class ImportTracksSerializer(serializers.Serializer):
+        athlete = serializers.IntegerField()
+        file = serializers.ListField(child=serializers.FileField(), allow_empty=False)
+
+    @action(detail=False, methods=['post'], url_path='import')
+    def import_tracks(self, request):
+        serializer = self.ImportTracksSerializer(data={
+            'athlete': request.data.get('athlete'),
+            'file': request.FILES.getlist('file'),
+        })
+        serializer.is_valid(raise_exception=True)
+        athlete = User.objects.filter(pk=serializer.validated_data['athlete'], is_staff=False).first()
+        if not athlete:
+            return Response(data={'error': 'Athlete not found'}, status=status.HTTP_400_BAD_REQUEST)
+        results = []
+        for file in serializer.validated_data['file']:
+            results.extend(import_tracks(athlete, file, file.name))
+        # partial imports still create runs, the failed files are reported next to them
+        if not any(result['run'] for result in results):
+            return Response(data=results, status=status.HTTP_400_BAD_REQUEST)
+        return Response(data=results, status=status.HTTP_201_CREATED)
+
+    class TrackQuerySerializer(serializers.Serializer):
+        tolerance = serializers.FloatField(min_value=0.0, default=5.0)
+        max_points = serializers.IntegerField(min_value=2, max_value=10000, required=False)
+
+    @action(detail=True, methods=['get'])
+    def track(self, request, pk=None):
+        run = self.get_object()
+        query = self.TrackQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        tolerance = query.validated_data['tolerance']
+        max_points = query.validated_data.get('max_points')
+        cache_key = f'run_track:{run.id}:{tolerance}:{max_points}'
+        data = cache.get(cache_key) if run.status == Run.FINISHED else None
+        if data is None:
+            from app_run.tracks import Track
+
+            track = Track.load(run)
+            data = {
+                'run': run.id,
+                'tolerance': tolerance,
+                'source_points': len(track),
+                'points': track.points(track.simplify(tolerance, max_points)),
+            }
+            if run.status == Run.FINISHED:
+                cache.set(cache_key, data, settings.RUN_TRACK_CACHE_TIMEOUT)
+        return Response(data, status=status.HTTP_200_OK)
+
+
+class ExportQuerySerializer(serializers.Serializer):
+    type = serializers.ChoiceField(choices=list(EXPORT_CONTENT_TYPES), default=GPX)
+
+
+def export_response(runs, export_format, file_name):
+    response = StreamingHttpResponse(export_runs(runs, export_format), content_type=EXPORT_CONTENT_TYPES[export_format])
+    response['Content-Disposition'] = f'attachment; filename="{file_name}.{export_format}"'
+    return response
+
+
+class RunsExportView(APIView):
+    class RunsExportQuerySerializer(ExportQuerySerializer):
+        athlete = serializers.IntegerField(required=False)
+        status = serializers.ChoiceField(choices=[choice for choice, _ in Run.STATUS_CHOICES], default=Run.FINISHED)
+        date_from = serializers.DateField(required=False)
+        date_to = serializers.DateField(required=False)
+
+    def get(self, request, *args, **kwargs):
+        query = self.RunsExportQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+        runs = Run.objects.filter(status=params['status']).defer('track').order_by('created_at', 'id')
+        if 'athlete' in params:
+            runs = runs.filter(athlete=params['athlete'])
+        if 'date_from' in params:
+            runs = runs.filter(created_at__date__gte=params['date_from'])
+        if 'date_to' in params:
+            runs = runs.filter(created_at__date__lte=params['date_to'])
+        return export_response(runs.iterator(chunk_size=500), params['type'], 'runs')
 
 
 class UserViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = User.objects.exclude(is_superuser=True).annotate(
-        runs_finished=Count('runs', filter=Q(runs__status=Run.FINISHED)),
-        rating=Avg('athletes__rate')
-    )
+        runs_finished=Coalesce('stats__runs_finished', 0),
+        items_count=Coalesce('stats__items_count', 0),
+        rating=Case(
+            When(stats__rating_count__gt=0, then=Cast('stats__rating_sum', FloatField()) / F('stats__rating_count')),
+            default=None,
+            output_field=FloatField(),
+        ),
+    ).order_by('id')
     serializer_class = UserSerializer
     filter_backends = [SearchFilter, OrderingFilter]
     search_fields = ['first_name', 'last_name']
@@ -146,6 +304,15 @@ class UserViewSet(viewsets.ReadOnlyModelViewSet):
             serializer = AthleteUserDetailSerializer(instance)
         return Response(serializer.data)
 
+    @action(detail=True, methods=['get'])
+    def items(self, request, pk=None):
+        user = get_object_or_404(User.objects.exclude(is_superuser=True).only('id'), pk=pk)
+        items = CollectibleItem.objects.filter(users=user).order_by('id')
+        page = self.paginate_queryset(items)
+        if page is not None:
+            return self.get_paginated_response(CollectibleItemSerializer(page, many=True).data)
+        return Response(CollectibleItemSerializer(items, many=True).data)
+
 class AthleteInfoApiView(APIView):
     def get(self, request, user_id=None):
         user = get_object_or_404(User, pk=user_id)
@@ -162,7 +329,7 @@ class AthleteInfoApiView(APIView):
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
-class ChallengeViewSet(viewsets.ReadOnlyModelViewSet):
+class ChallengeViewSet(KeysetPaginationMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Challenge.objects.all()
     serializer_class = ChallengeSerializer
     filter_backends = [DjangoFilterBackend,]
@@ -170,26 +337,110 @@ class ChallengeViewSet(viewsets.ReadOnlyModelViewSet):
     pagination_class = PagePagination
 
 
-class PositionViewSet(viewsets.ModelViewSet):
+class PositionViewSet(KeysetPaginationMixin, viewsets.ModelViewSet):
     queryset = Position.objects.all()
     serializer_class = PositionSerializer
+    # positions are append-only: run totals and later fixes' cumulative distance are built incrementally on create
+    http_method_names = ['get', 'post', 'head', 'options']
     filter_backends = [DjangoFilterBackend,]
     filterset_fields = ['run',]
     pagination_class = PagePagination
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [ColumnarRenderer]
+
+    def list(self, request, *args, **kwargs):
+        run_id = request.query_params.get('run', '')
+        track = None
+        if run_id.isdigit():
+            track = Run.objects.filter(pk=run_id, track__isnull=False).values_list('track', flat=True).first()
+        columnar = request.accepted_renderer.format == ColumnarRenderer.format
+        if track is None and not columnar:
+            return super().list(request, *args, **kwargs)
+
+        if isinstance(self.paginator, KeysetPagination):
+            self._paginator = PagePagination()
+        if track is not None:
+            from app_run.archive import build_positions, iter_track_rows
+
+            positions = list(iter_track_rows(track)) if columnar else build_positions(int(run_id), track)
+        else:
+            positions = self.filter_queryset(self.get_queryset()).values_list(*POSITION_COLUMNS)
+        page = self.paginate_queryset(positions)
+        if page is not None:
+            positions = page
+        data = get_position_columns(positions) if columnar else self.get_serializer(positions, many=True).data
+        if page is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
 
     def perform_create(self, serializer):
-        distance = 0
-        speed = 0
         run = serializer.validated_data['run']
         last_position = Position.objects.filter(run=run).order_by('date_time').last()
-        if last_position:
-            d = geodesic((last_position.latitude, last_position.longitude), (serializer.validated_data['latitude'], serializer.validated_data['longitude'])).kilometers
-            distance = round(last_position.distance + d, 2)
-            speed = calculate_speed(start_time=last_position.date_time, end_time=serializer.validated_data['date_time'], distance=d)
-
+        date_time = serializer.validated_data['date_time']
+        segment, distance, speed = calculate_position_metrics(
+            last_position,
+            serializer.validated_data['latitude'],
+            serializer.validated_data['longitude'],
+            date_time,
+        )
         serializer.validated_data['distance'] = distance
         serializer.validated_data['speed'] = speed
-        serializer.save()
+        with transaction.atomic():
+            serializer.save()
+            update_run_totals(run.id, 1, segment, speed, date_time, date_time)
+            publish_positions(run.id, [serializer.instance])
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        serializer = PositionBulkSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        run = serializer.validated_data['run']
+        last_position = Position.objects.filter(run=run).order_by('date_time').last()
+        positions = []
+        total_distance = 0
+        for fix in serializer.validated_data['positions']:
+            position = Position(run=run, **fix)
+            segment, position.distance, position.speed = calculate_position_metrics(
+                last_position, position.latitude, position.longitude, position.date_time
+            )
+            total_distance += segment
+            positions.append(position)
+            last_position = position
+
+        date_times = [position.date_time for position in positions if position.date_time is not None]
+        with transaction.atomic():
+            Position.objects.bulk_create(positions)
+            update_run_totals(
+                run.id,
+                len(positions),
+                total_distance,
+                sum(position.speed for position in positions),
+                min(date_times, default=None),
+                max(date_times, default=None),
+            )
+            if not settings.COLLECT_ITEMS_ON_STOP:
+                collect_items_along(run.athlete, [(position.latitude, position.longitude) for position in positions])
+            publish_positions(run.id, positions)
+        return Response(PositionSerializer(positions, many=True).data, status=status.HTTP_201_CREATED)
+
+
+POSITION_COLUMNS = ['id', 'latitude', 'longitude', 'date_time', 'distance', 'speed']
+
+
+def get_position_columns(rows):
+    """Transpose (id, latitude, longitude, date_time, distance, speed, ...) rows into parallel arrays.
+
+    Times are Unix timestamps in seconds.
+    """
+    columns = list(zip(*rows)) or [()] * len(POSITION_COLUMNS)
+    ids, lats, longs, date_times, distances, speeds = columns[:len(POSITION_COLUMNS)]
+    return {
+        'id': list(ids),
+        'lat': [float(lat) for lat in lats],
+        'lon': [float(long) for long in longs],
+        't': [date_time.timestamp() if date_time is not None else None for date_time in date_times],
+        'distance': list(distances),
+        'speed': list(speeds),
+    }
 
 
 class CollectibleItemViewSet(viewsets.ReadOnlyModelViewSet):
@@ -197,40 +448,117 @@ class CollectibleItemViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = CollectibleItemSerializer
     pagination_class = PagePagination
 
-
-def process_file(file):
-    workbook = openpyxl.load_workbook(file)
-    sheet = workbook.active
-    collectible_items = []
-    row_errors = []
-    column_names = ['name', 'uid', 'value', 'latitude', 'longitude', 'picture']
-    for row in sheet.iter_rows(min_row=2, values_only=True):
-        if all(value is None for value in row):
-            continue
-
-        item_row = {name: value for name, value in zip(column_names, row)}
-        item = CollectibleItem(**item_row)
-        serializer = CollectibleItemSerializer(data=item_row)
-        if serializer.is_valid():
-            collectible_items.append(item)
+    class NearbyQuerySerializer(serializers.Serializer):
+        near = serializers.CharField(required=False, help_text='lat,lon')
+        radius = serializers.FloatField(min_value=1, max_value=MAX_NEARBY_RADIUS, default=1000)
+        bbox = serializers.CharField(required=False, help_text='min_lon,min_lat,max_lon,max_lat')
+        nearest = serializers.IntegerField(min_value=1, max_value=PagePagination.max_page_size, required=False)
+
+        def parse_floats(self, value, count):
+            try:
+                numbers = [float(number) for number in value.split(',')]
+            except ValueError:
+                numbers = []
+            if len(numbers) != count:
+                raise serializers.ValidationError(f'Expected {count} comma separated numbers')
+            return numbers
+
+        def validate_near(self, value):
+            lat, long = self.parse_floats(value, 2)
+            if not (-90 <= lat <= 90 and -180 <= long <= 180):
+                raise serializers.ValidationError('Coordinates out of range')
+            return lat, long
+
+        def validate_bbox(self, value):
+            min_long, min_lat, max_long, max_lat = self.parse_floats(value, 4)
+            if not (-90 <= min_lat <= max_lat <= 90 and -180 <= min_long <= max_long <= 180):
+                raise serializers.ValidationError('Expected min_lon,min_lat,max_lon,max_lat within range')
+            return min_lat, min_long, max_lat, max_long
+
+        def validate(self, attrs):
+            if 'nearest' in attrs and 'near' not in attrs:
+                raise serializers.ValidationError({'nearest': 'Requires near=lat,lon'})
+            # the area must stay within the grid cell index, otherwise the whole table would be scanned and sorted
+            if 'bbox' in attrs and get_cells(*attrs['bbox']) is None:
+                raise serializers.ValidationError({'bbox': f'Bounding box spans more than {MAX_GRID_CELLS} grid cells'})
+            near_box = 'near' in attrs and get_bounding_box([attrs['near']], attrs['radius'])
+            if 'bbox' not in attrs and near_box and get_cells(*near_box) is None:
+                raise serializers.ValidationError({'radius': f'Search area spans more than {MAX_GRID_CELLS} grid cells'})
+            return attrs
+
+    def list(self, request, *args, **kwargs):
+        query = self.NearbyQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+        if 'near' not in params and 'bbox' not in params:
+            return super().list(request, *args, **kwargs)
+
+        items = self.get_nearby_items(params)
+        page = self.paginate_queryset(items)
+        if page is not None:
+            return self.get_paginated_response(CollectibleItemDistanceSerializer(page, many=True).data)
+        return Response(CollectibleItemDistanceSerializer(items, many=True).data)
+
+    def get_nearby_items(self, params):
+        """Items found through the grid cell index, sorted by distance in metres from near or the bbox centre."""
+        queryset = self.filter_queryset(self.get_queryset())
+        if 'bbox' in params:
+            min_lat, min_long, max_lat, max_long = params['bbox']
+            lat, long = params.get('near', ((min_lat + max_lat) / 2, (min_long + max_long) / 2))
+            items = self.sort_by_distance(filter_by_bounding_box(queryset, *params['bbox']), lat, long)
         else:
-            row_errors.append(row)
+            lat, long = params['near']
+            radius = params['radius']
+            while True:
+                box = get_bounding_box([(lat, long)], radius)
+                items = [
+                    item for item in self.sort_by_distance(filter_by_bounding_box(queryset, *box), lat, long)
+                    if item.distance <= radius
+                ]
+                # widen the search until it holds the k nearest items or leaves the grid cell index
+                wider = min(radius * 4, MAX_NEARBY_RADIUS)
+                if (
+                    'nearest' not in params or len(items) >= params['nearest'] or wider == radius
+                    or get_cells(*get_bounding_box([(lat, long)], wider)) is None
+                ):
+                    break
+                radius = wider
+        if 'nearest' in params:
+            items = items[:params['nearest']]
+        return items
+
+    @staticmethod
+    def sort_by_distance(queryset, lat, long):
+        items = list(queryset)
+        for item in items:
+            item.distance = round(haversine(lat, long, item.latitude, item.longitude), 1)
+        items.sort(key=lambda item: (item.distance, item.id))
+        return items
 
-    CollectibleItem.objects.bulk_create(
-        collectible_items,
-        batch_size=1000,
-        update_conflicts=True,
-        update_fields=['name', 'value', 'latitude', 'longitude', 'picture'],
-        unique_fields=['uid']
-    )
-    return row_errors
+
+def process_file(file):
+    """Import the file and return the rejected rows, with headers telling whether that list was cut short."""
+    result = import_collectible_items(file)
+    headers = {'X-Rows-Failed': str(result.rows_failed)}
+    if result.errors_truncated:
+        headers['X-Errors-Truncated'] = 'true'
+    return [error['values'] for error in result.errors], headers
 
 
 class UploadCollectibleItemFileView(APIView):
     def post(self, request, *args, **kwargs):
         file = request.FILES['file']
-        errors = process_file(file)
-        return Response(data=errors, status=status.HTTP_200_OK)
+        if not settings.UPLOAD_FILE_ASYNC:
+            errors, headers = process_file(file)
+            return Response(data=errors, status=status.HTTP_200_OK, headers=headers)
+        job = UploadJob.objects.create(file_name=file.name, file=file.read())
+        return Response(data={'job_id': job.id, 'status': job.status}, status=status.HTTP_202_ACCEPTED)
+
+
+class UploadJobStatusView(APIView):
+    def get(self, request, job_id, *args, **kwargs):
+        job = get_object_or_404(UploadJob.objects.defer('file'), pk=job_id)
+        return Response(data=UploadJobSerializer(job).data, status=status.HTTP_200_OK)
 
 
 class SubscribeToCoachView(APIView):
@@ -255,25 +583,26 @@ class SubscribeToCoachView(APIView):
 
 class ChallengesSummaryView(APIView):
     def get(self, request, *args, **kwargs):
-        # challenges = Challenge.objects.distinct('full_name').order_by('full_name').select_related('athlete').annotate(athletes=ArrayAgg('athlete')) and split it
-        challenges = Challenge.objects.order_by('full_name').select_related('athlete')
-        result = []
-        added = set()
-        for challenge in challenges:
-            if challenge.full_name not in added:
-                item = {
+        cache_key = get_challenges_summary_cache_key()
+        data = cache.get(cache_key)
+        if data is None:
+            challenges = Challenge.objects.order_by('full_name', 'created_at', 'id').select_related('athlete').only(
+                'full_name',
+                'athlete__id',
+                'athlete__username',
+                'athlete__first_name',
+                'athlete__last_name',
+            )
+            result = {}
+            for challenge in challenges:
+                item = result.setdefault(challenge.full_name, {
                     'name_to_display': challenge.full_name,
-                    'athletes': []
-                }
-                result.append(item)
-                added.add(challenge.full_name)
-            else:
-                for item in result:
-                    if item['name_to_display'] == challenge.full_name:
-                        item['athletes'].append(challenge.athlete)
-
-        serializer = ChallengeSummarySerializer(result, many=True)
-        return Response(data=serializer.data, status=status.HTTP_200_OK)
+                    'athletes': [],
+                })
+                item['athletes'].append(challenge.athlete)
+            data = ChallengeSummarySerializer(result.values(), many=True).data
+            cache.set(cache_key, data, settings.CHALLENGES_SUMMARY_CACHE_TIMEOUT)
+        return Response(data=data, status=status.HTTP_200_OK)
 
 
 class RateCoachView(APIView):
@@ -315,11 +644,7 @@ class AnalyticsForCoachView(APIView):
         if not coach.is_staff:
             return Response(data={'error': 'Coach not found'}, status=status.HTTP_400_BAD_REQUEST)
         athlete_ids = Subscription.objects.filter(coach=coach).values_list('athlete_id', flat=True)
-        users = User.objects.filter(id__in=athlete_ids).annotate(
-            longest_run_value=Max('runs__distance', filter=Q(runs__status=Run.FINISHED), output_field=FloatField()),
-            total_run_value=Sum('runs__distance', filter=Q(runs__status=Run.FINISHED), output_field=FloatField()),
-            speed_avg_value=Avg('runs__speed', filter=Q(runs__status=Run.FINISHED), output_field=FloatField()),
-        )
+        athletes_stats = AthleteStats.objects.filter(athlete__in=athlete_ids)
         longest_run_user = None
         longest_run_value = 0.0
         total_run_user = None
@@ -327,16 +652,16 @@ class AnalyticsForCoachView(APIView):
         speed_avg_user = None
         speed_avg_value = 0.0
 
-        for user in users:
-            if user.longest_run_value and user.longest_run_value > longest_run_value:
-                longest_run_user = user.id
-                longest_run_value = user.longest_run_value
-            if user.total_run_value and user.total_run_value > total_run_value:
-                total_run_user = user.id
-                total_run_value = user.total_run_value
-            if user.speed_avg_value and user.speed_avg_value > speed_avg_value:
-                speed_avg_user = user.id
-                speed_avg_value = user.speed_avg_value
+        for stats in athletes_stats:
+            if stats.longest_run and stats.longest_run > longest_run_value:
+                longest_run_user = stats.athlete_id
+                longest_run_value = stats.longest_run
+            if stats.total_distance and stats.total_distance > total_run_value:
+                total_run_user = stats.athlete_id
+                total_run_value = stats.total_distance
+            if stats.average_speed and stats.average_speed > speed_avg_value:
+                speed_avg_user = stats.athlete_id
+                speed_avg_value = stats.average_speed
 
         results = {
             'longest_run_user': longest_run_user,
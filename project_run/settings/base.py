@@ -45,6 +45,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'app_run.metrics.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -118,4 +119,42 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 COMPANY_NAME = 'Бегуны'
 COMPANY_SLOGAN = 'Беги за своими мечами'
-COMPANY_CONTACTS = 'г. Сыктывкар ул. Пушкина 1'
\ No newline at end of file
+COMPANY_CONTACTS = 'г. Сыктывкар ул. Пушкина 1'
+
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'app_run.renderers.ORJSONRenderer',
+        'app_run.renderers.MessagePackRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'app_run.parsers.ORJSONParser',
+        'app_run.parsers.MessagePackParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+}
+
+# Import uploaded collectible item files in the process_upload_jobs worker
+UPLOAD_FILE_ASYNC = True
+
+# The summary cache key is stamped from the challenge rows, so per-process caches never serve a stale summary
+CHALLENGES_SUMMARY_CACHE_TIMEOUT = 300
+RUN_TRACK_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Add X-Query-Count and Server-Timing headers to every response
+REQUEST_METRICS_HEADERS = DEBUG
+
+# Pub/sub backend feeding /api/runs/<id>/live/, which is only served under ASGI (501 under WSGI);
+# the local broker only reaches watchers in the same process, so multi-process deployments need a shared broker
+LIVE_BROKER = 'app_run.live.LocalBroker'
+LIVE_HEARTBEAT_SECONDS = 15
+
+# Distance formula for incoming positions: 'geodesic' (ellipsoidal, slowest), 'haversine' or 'equirectangular'
+DISTANCE_BACKEND = 'geodesic'
+
+# Match the whole track against collectible items when a run is stopped instead of on every position
+COLLECT_ITEMS_ON_STOP = False
+
+# Import views and build URL resolver caches while the process starts rather than on its first request
+STARTUP_WARMUP = False